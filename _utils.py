@@ -1,21 +1,47 @@
 import time
 import datetime
+import functools
 import os
 import platform
+import configparser
 from loguru import logger
+import metrics
 
 def t(n):
-    return time.strftime("%H:%M:%S", time.gmtime(n))
+    """t - длительность в секундах в виде ЧЧ:ММ:СС.ммм"""
+    return time.strftime("%H:%M:%S", time.gmtime(n)) + f".{int(n % 1 * 1000):03d}"
 
 def timing_decorator(func):
+    """timing_decorator - время работы функции в лог и интервал метрик с её именем (см. metrics)"""
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        logger.info(f"Время работы функции {func.__name__}: {t(end_time - start_time)}.")
+        with metrics.span(func.__name__) as s:
+            result = func(*args, **kwargs)
+        logger.info(f"Время работы функции {func.__name__}: {t(s.duration)}.")
         return result
     return wrapper  
 
+def get_settings():
+    """get_settings - settings.ini на уровень выше каталога скриптов"""
+    ini_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "settings.ini"))
+    config = configparser.ConfigParser()
+    config.read(ini_path)
+    return config
+
+def cache_dir(name):
+    """cache_dir - каталог локального кэша (создаётся при необходимости)
+
+    Корень берётся из settings.ini: [cache] path, по умолчанию - каталог cache рядом со скриптами.
+    """
+    root = get_settings().get("cache", "path", fallback="") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def metrics_dir():
+    """metrics_dir - каталог файлов метрик запусков: [metrics] path, по умолчанию - каталог metrics рядом со скриптами"""
+    return get_settings().get("metrics", "path", fallback="") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")
+
 def getSpecialPath(APath):
     if APath[-1] != '\\':
         APath = APath + "\\"
@@ -28,11 +54,10 @@ def creation_date(path_to_file):
     if platform.system() == 'Windows':
         return datetime.datetime.fromtimestamp(os.path.getctime(path_to_file))  
     else:
-        stat =  datetime.datetime.fromtimestamp(os.stat(path_to_file))  
+        stat = os.stat(path_to_file)
         try:
-            return stat.st_birthtime
+            return datetime.datetime.fromtimestamp(stat.st_birthtime)
         except AttributeError:
             # Вероятно, мы используем Linux. Здесь нет простого способа получить даты создания,
             # поэтому мы остановимся на том, когда его содержимое было изменено в последний раз.
-            return stat.st_mtime
-            
\ No newline at end of file
+            return datetime.datetime.fromtimestamp(stat.st_mtime)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+'''
+Запись данных для BULK INSERT в двоичном формате SQL Server (как bcp -n)
+с файлом формата для него.
+
+Каждое поле записывается с префиксом длины, NULL - префикс из байтов 0xFF без данных:
+  'str'   - SQLCHAR, префикс 2 байта, текст в UTF-8 (BULK INSERT ... CODEPAGE = '65001');
+  'float' - SQLFLT8, префикс 1 байт, 8 байт IEEE 754;
+  'int'   - SQLBIGINT, префикс 1 байт, 8 байт.
+Табуляции и переводы строк внутри текста не требуют экранирования: разделителей нет.
+Файл собирается целиком в numpy по смещениям полей, без цикла по строкам.
+'''
+
+# Версия формата файла формата (SQL Server 2012 и новее)
+FORMAT_VERSION = "11.0"
+
+# Максимальная длина текстового поля в байтах для SQLCHAR с двухбайтовым префиксом
+MAX_CHAR_BYTES = 8000
+
+_HOST_TYPES = {
+    "str": ("SQLCHAR", 2, MAX_CHAR_BYTES),
+    "float": ("SQLFLT8", 1, 8),
+    "int": ("SQLBIGINT", 1, 8),
+}
+
+
+def format_file(columns, kinds):
+    """format_file - текст файла формата (не XML) для столбцов columns с типами kinds"""
+    lines = [FORMAT_VERSION, str(len(columns))]
+    for i, col in enumerate(columns, start=1):
+        host_type, prefix, length = _HOST_TYPES[kinds.get(col) or "str"]
+        lines.append(f'{i}\t{host_type}\t{prefix}\t{length}\t""\t{i}\t{col}\t""')
+    return "\n".join(lines) + "\n"
+
+
+def _text(s):
+    # Строки в массив Arrow: длины и байты UTF-8 берутся из буферов без цикла по значениям
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # категории переводятся в строки один раз, значения собираются по кодам
+        codes = s.cat.codes.to_numpy()
+        categories, _ = _text(pd.Series(s.cat.categories, dtype=object))
+        arr = pc.take(categories, pa.array(codes, mask=codes < 0))
+        return pc.fill_null(arr, ""), codes < 0
+    if not pd.api.types.is_string_dtype(s.dtype) or pd.api.types.infer_dtype(s, skipna=True) not in ("string", "empty"):
+        s = s.astype(object).where(s.isna(), s.astype(str))
+    arr = pa.array(s, type=pa.large_string(), from_pandas=True)
+    null = arr.is_null().to_numpy(zero_copy_only=False)
+    # NULL отмечен маской, в массиве - пустые строки нулевой длины
+    arr = pc.fill_null(arr, "")
+    longest = pc.max(pc.binary_length(arr)).as_py() if len(arr) else None
+    if longest and longest > MAX_CHAR_BYTES:
+        # UTF-8 символ занимает до 4 байт
+        arr = pc.utf8_slice_codeunits(arr, 0, MAX_CHAR_BYTES // 4)
+    return arr, null
+
+
+def _numbers(s, kind):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    if not pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+        s = pd.to_numeric(s, errors="coerce")
+    values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+    null = np.isnan(values)
+    if kind == "int":
+        values = np.where(null, 0, values).astype("<i8")
+    else:
+        values = values.astype("<f8")
+    return values, null
+
+
+def encode_native(df, columns, kinds):
+    """encode_native - строки df (столбцы columns) в байтах двоичного формата, массив uint8"""
+    n = len(df)
+    if n == 0:
+        return np.zeros(0, dtype=np.uint8)
+    fields = []
+    for col in columns:
+        kind = kinds.get(col) or "str"
+        s = df[col] if col in df.columns else pd.Series([None] * n, index=df.index, dtype=object)
+        if kind == "str":
+            arr, null = _text(s)
+            offsets = np.frombuffer(arr.buffers()[1], dtype=np.int64)[arr.offset:arr.offset + n + 1]
+            lengths = np.diff(offsets)
+            fields.append((kind, 2, (arr, offsets), null, lengths))
+        else:
+            values, null = _numbers(s, kind)
+            lengths = np.where(null, 0, 8).astype(np.int64)
+            fields.append((kind, 1, values, null, lengths))
+
+    # Длина каждого поля с префиксом и начало каждого поля в выходном буфере
+    sizes = np.stack([prefix + lengths for _, prefix, _, _, lengths in fields], axis=1)
+    starts = np.cumsum(sizes.ravel()).reshape(sizes.shape) - sizes
+    out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+
+    for c, (kind, prefix, data, null, lengths) in enumerate(fields):
+        pos = starts[:, c]
+        # Префикс длины (little-endian), для NULL - все байты 0xFF
+        plen = np.where(null, (1 << (8 * prefix)) - 1, lengths)
+        for b in range(prefix):
+            out[pos + b] = (plen >> (8 * b)) & 0xFF
+        if kind == "str":
+            data, offsets = data
+            raw = data.buffers()[2]
+            if raw is None or offsets[-1] == offsets[0]:
+                continue
+            raw = np.frombuffer(raw, dtype=np.uint8)[offsets[0]:offsets[-1]]
+            dst = np.repeat(pos + prefix - offsets[:-1], lengths) + np.arange(offsets[0], offsets[-1])
+            out[dst] = raw
+        else:
+            rows = ~null
+            dst = (pos[rows] + prefix)[:, None] + np.arange(8)
+            out[dst] = data[rows].view(np.uint8).reshape(-1, 8)
+    return out
+
+
+def write_native(df, fh, columns, kinds):
+    """write_native - дописать строки df в открытый двоичный файл"""
+    encode_native(df, columns, kinds).tofile(fh)
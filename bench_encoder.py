@@ -0,0 +1,79 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import price_encoder
+
+'''
+Сравнение скорости подготовки строк для executemany:
+прежний способ (pd.isna для каждой ячейки) и price_encoder.
+
+Запуск: python bench_encoder.py --rows 1000000
+'''
+
+KINDS = {
+    "Brand": "str", "DetailNum": "str", "DetailPrice": "float", "DetailName": "str",
+    "PriceLogo": "str", "Quantity": "int", "PackQuantity": "int", "Reliability": "float",
+    "WeightKG": "float", "VolumeKG": "float", "MOSA": "float", "Restrictions": "str",
+}
+
+
+def make_frame(rows, seed=0):
+    """make_frame - синтетический прайс в формате pPrice с ~5% пропусков в числовых полях"""
+    rng = np.random.default_rng(seed)
+
+    def with_nan(values):
+        values = values.astype(float)
+        values[rng.random(rows) < 0.05] = np.nan
+        return values
+
+    brands = np.array([f"BRAND{i}" for i in range(500)], dtype=object)
+    return pd.DataFrame({
+        "Brand": brands[rng.integers(0, len(brands), rows)],
+        "DetailNum": pd.Series(rng.integers(0, 10**9, rows)).map("{:09d}".format),
+        "DetailPrice": with_nan(rng.random(rows) * 10000),
+        "DetailName": "Деталь",
+        "PriceLogo": "EMEX",
+        "Quantity": with_nan(rng.integers(0, 1000, rows)),
+        "PackQuantity": with_nan(rng.integers(1, 10, rows)),
+        "Reliability": with_nan(rng.random(rows) * 100),
+        "WeightKG": with_nan(rng.random(rows) * 50),
+        "VolumeKG": with_nan(rng.random(rows) * 50),
+        "MOSA": with_nan(rng.random(rows)),
+        "Restrictions": np.where(rng.random(rows) < 0.9, None, "NOAIR"),
+    })
+
+
+def legacy_rows(df):
+    cols = list(df.columns)
+    return [[None if pd.isna(v) else v for v in row] for row in df[cols].values.tolist()]
+
+
+def encoder_rows(df):
+    rows = []
+    for batch in price_encoder.iter_batches(df, price_encoder.BATCH_SIZE, KINDS):
+        rows.extend(batch)
+    return rows
+
+
+def measure(name, func, df, repeat):
+    best = None
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func(df)
+        elapsed = time.perf_counter() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<10} {len(df) / best:>14,.0f} строк/с  ({best:.3f} с)")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Скорость подготовки строк для executemany")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    legacy = measure("legacy", legacy_rows, df, args.repeat)
+    encoder = measure("encoder", encoder_rows, df, args.repeat)
+    print(f"Ускорение: {legacy / encoder:.1f}x")
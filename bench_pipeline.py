@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import codecs
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import openpyxl
+import price_reader
+import price_encoder
+from price_sinks import NullSink, SqliteSink
+from _utils import cache_dir
+from metrics import peak_rss
+
+'''
+Нагрузочный тест конвейера загрузки прайсов на синтетических файлах.
+
+Файлы генерируются детерминированно (один и тот же seed - один и тот же файл)
+в формате 48H.txt (см. load_prices_params.py: 38 столбцов, ANSI, табуляция,
+первая строка - заголовок) и в виде xlsx, и сохраняются в cache/bench для
+повторных запусков. Этапы read (чтение частями), map (маппинг), encode
+(подготовка строк для executemany) и sink (price_sinks: null - строки отбрасываются,
+sqlite - вставка в таблицу pPrice в памяти) замеряются отдельно.
+Каждый размер и формат запускается в отдельном процессе, чтобы пиковая
+память (peak RSS) относилась к одному прогону.
+
+Запуск: python bench_pipeline.py --size 10k 1m --format txt xlsx --sink sqlite
+Регрессии: --save base.json, затем --baseline base.json (код возврата 1 при замедлении)
+'''
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+# Excel вмещает 1 048 576 строк на лист, одна занята заголовком
+MAX_XLSX_ROWS = 1_048_575
+
+# Столбцы 48H.txt: 12 описанных в load_prices_params.py и 26 цен с доставкой
+COLUMNS_48H = [
+    "MakeLogo", "DetailNum", "DetailPrice", "DetailName", "PriceLogo", "Quantity",
+    "PackQuantity", "Reliability", "WeightKG", "VolumeKG", "RESTR", "MOSA",
+] + [f"Price{i:02d}" for i in range(1, 27)]
+
+# Маппинг профиля для 48H.txt в формате PriceLoader.get_file_jobs (DataValue - номер столбца с 1)
+FIELD_MAP_48H = {
+    field: {"MappingDataType": 0, "FieldDataType": ftype, "DataValue": str(col)}
+    for field, ftype, col in [
+        ("Brand", "varchar", 1), ("DetailNum", "varchar", 2), ("DetailPrice", "float", 3),
+        ("DetailName", "varchar", 4), ("PriceLogo", "varchar", 5), ("Quantity", "int", 6),
+        ("PackQuantity", "int", 7), ("Reliability", "float", 8), ("WeightKG", "float", 9),
+        ("VolumeKG", "float", 10), ("Restrictions", "varchar", 11), ("MOSA", "float", 12),
+    ]
+}
+
+GEN_CHUNK = 200000
+
+STAGES = ["read", "map", "encode", "sink"]
+
+
+def make_chunk(rows, seed, part):
+    """make_chunk - часть синтетического 48H.txt (одинаковая для одинаковых seed и part)"""
+    rng = np.random.default_rng([seed, part])
+    brands = np.array([f"{a}{b}{c}" for a in "ABCDEFGH" for b in "KLMNOPQR" for c in "STUVWXYZ"], dtype=object)
+    names = np.array(["Фильтр масляный", "Колодки тормозные", "Свеча зажигания", "Ремень ГРМ",
+                      "Амортизатор передний", "Датчик кислородный", "Прокладка", "Подшипник ступицы"], dtype=object)
+
+    def money(high):
+        return np.round(rng.random(rows) * high, 2)
+
+    data = {
+        "MakeLogo": brands[rng.integers(0, len(brands), rows)],
+        "DetailNum": pd.Series(rng.integers(0, 10**10, rows)).map("{:010d}".format).to_numpy(),
+        "DetailPrice": money(20000),
+        "DetailName": names[rng.integers(0, len(names), rows)],
+        "PriceLogo": np.where(rng.random(rows) < 0.5, "EMIR", "FAST"),
+        "Quantity": rng.integers(0, 500, rows),
+        "PackQuantity": rng.integers(1, 10, rows),
+        "Reliability": rng.integers(0, 101, rows),
+        "WeightKG": np.round(rng.random(rows) * 30, 3),
+        "VolumeKG": np.round(rng.random(rows) * 30, 3),
+        "RESTR": np.where(rng.random(rows) < 0.9, "", "NOAIR"),
+        "MOSA": money(1),
+    }
+    for col in COLUMNS_48H[12:]:
+        data[col] = money(25000)
+    return pd.DataFrame(data, columns=COLUMNS_48H)
+
+
+def _chunks(rows, seed):
+    for part, start in enumerate(range(0, rows, GEN_CHUNK)):
+        yield make_chunk(min(GEN_CHUNK, rows - start), seed, part)
+
+
+def generate_txt(path, rows, seed=0):
+    """generate_txt - файл в формате 48H.txt: табуляция, cp1251, заголовок"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="cp1251", newline="") as f:
+        f.write("\t".join(COLUMNS_48H) + "\r\n")
+        for df in _chunks(rows, seed):
+            df.to_csv(f, sep="\t", index=False, header=False, lineterminator="\r\n")
+    os.replace(tmp, path)
+
+
+def generate_xlsx(path, rows, seed=0):
+    """generate_xlsx - те же данные в xlsx (первый лист, заголовок в первой строке)"""
+    if rows > MAX_XLSX_ROWS:
+        raise ValueError(f"В xlsx помещается не больше {MAX_XLSX_ROWS} строк данных")
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(COLUMNS_48H)
+    for df in _chunks(rows, seed):
+        for row in df.itertuples(index=False, name=None):
+            ws.append(row)
+    tmp = path + ".tmp.xlsx"
+    wb.save(tmp)
+    os.replace(tmp, path)
+
+
+def bench_file(fmt, rows, seed=0):
+    """bench_file - путь к сгенерированному файлу (создаётся при первом обращении)"""
+    path = os.path.join(cache_dir("bench"), f"48H_{rows}_{seed}.{fmt}")
+    if not os.path.exists(path):
+        print(f"Генерация {path} ...", flush=True)
+        (generate_txt if fmt == "txt" else generate_xlsx)(path, rows, seed)
+    return path
+
+
+def run_case(fmt, rows, sink_name, chunksize, seed=0):
+    """run_case - прогон всех этапов для одного файла, возвращает результаты по этапам"""
+    if fmt == "txt":
+        try:
+            codecs.lookup("ansi")
+        except LookupError:
+            # кодировка "ansi" есть только в Windows, там это cp1251 для русской локали
+            codecs.register(lambda name: codecs.lookup("cp1251") if name == "ansi" else None)
+
+    path = bench_file(fmt, rows, seed)
+    size = os.path.getsize(path)
+    file_type = 0 if fmt == "txt" else 1
+    kinds = price_encoder.field_kinds(FIELD_MAP_48H)
+    sink = SqliteSink(":memory:", kinds) if sink_name == "sqlite" else NullSink(kinds)
+    columns = list(FIELD_MAP_48H)
+    elapsed = dict.fromkeys(STAGES, 0.0)
+    total = 0
+
+    chunks = price_reader.read_chunks(path, file_type, "\t", True, chunksize, FIELD_MAP_48H)
+    started = time.perf_counter()
+    while True:
+        tic = time.perf_counter()
+        df_raw = next(chunks, None)
+        elapsed["read"] += time.perf_counter() - tic
+        if df_raw is None:
+            break
+
+        tic = time.perf_counter()
+        df_ready = price_reader.map_chunk(df_raw, FIELD_MAP_48H, path)
+        elapsed["map"] += time.perf_counter() - tic
+
+        batches = price_encoder.iter_batches(df_ready, price_encoder.BATCH_SIZE, kinds)
+        while True:
+            tic = time.perf_counter()
+            batch = next(batches, None)
+            elapsed["encode"] += time.perf_counter() - tic
+            if batch is None:
+                break
+            tic = time.perf_counter()
+            sink.write_batch(columns, batch)
+            elapsed["sink"] += time.perf_counter() - tic
+        total += len(df_ready)
+
+    tic = time.perf_counter()
+    sink.close()
+    elapsed["sink"] += time.perf_counter() - tic
+    elapsed["total"] = time.perf_counter() - started
+
+    return {
+        "case": f"{fmt}/{rows}/{sink_name}",
+        "rows": total,
+        "bytes": size,
+        "peak_rss": peak_rss(),
+        "stages": {
+            stage: {
+                "seconds": seconds,
+                "rows_s": total / seconds if seconds else None,
+                "mb_s": size / 2**20 / seconds if seconds else None,
+            }
+            for stage, seconds in elapsed.items()
+        },
+    }
+
+
+def report(result):
+    print(f"\n{result['case']}: строк {result['rows']:,}, файл {result['bytes'] / 2**20:.1f} МБ, "
+          f"пиковая память {result['peak_rss'] / 2**20:.0f} МБ")
+    print(f"{'этап':<8}{'секунд':>10}{'строк/с':>16}{'МБ/с':>10}")
+    for stage, m in result["stages"].items():
+        rows_s = f"{m['rows_s']:,.0f}" if m["rows_s"] else "-"
+        mb_s = f"{m['mb_s']:.1f}" if m["mb_s"] else "-"
+        print(f"{stage:<8}{m['seconds']:>10.3f}{rows_s:>16}{mb_s:>10}")
+
+
+def compare(results, baseline, tolerance):
+    """compare - этапы, которые медленнее базового прогона больше чем на tolerance (доля)"""
+    base = {r["case"]: r for r in baseline}
+    slower = []
+    for r in results:
+        if r["case"] not in base:
+            continue
+        for stage, m in r["stages"].items():
+            old = base[r["case"]]["stages"].get(stage, {}).get("rows_s")
+            if old and m["rows_s"] and m["rows_s"] < old * (1 - tolerance):
+                slower.append(f"{r['case']} {stage}: {m['rows_s']:,.0f} строк/с против {old:,.0f}")
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест этапов загрузки прайсов на синтетических файлах")
+    parser.add_argument("--size", nargs="+", choices=list(SIZES), default=["10k"], help="размеры файлов")
+    parser.add_argument("--format", nargs="+", choices=["txt", "xlsx"], default=["txt", "xlsx"], help="форматы файлов")
+    parser.add_argument("--sink", choices=["null", "sqlite"], default="null", help="приёмник строк")
+    parser.add_argument("--chunksize", type=int, default=price_reader.CHUNK_SIZE, help="размер части файла, строк")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="сравнить с сохранённым ранее JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое замедление этапа (доля)")
+    args = parser.parse_args()
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for fmt in args.format:
+        for size in args.size:
+            rows = SIZES[size]
+            if fmt == "xlsx" and rows > MAX_XLSX_ROWS:
+                print(f"\nxlsx/{rows}: пропущено, в лист Excel помещается не больше {MAX_XLSX_ROWS} строк")
+                continue
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_case, (fmt, rows, args.sink, args.chunksize, args.seed))
+            report(result)
+            results.append(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for line in slower:
+            print(f"Замедление: {line}")
+        sys.exit(1 if slower else 0)
@@ -0,0 +1,173 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from file_manifest import file_hash
+from _utils import cache_dir
+
+'''
+Локальный справочник брендов: зашифрованный код (MakeLogo) -> название бренда.
+
+Строится из всех файлов Makes (см. load_brands.py: код, название, страна; без
+заголовка) вместе и хранится в parquet; в метаданных - размер, время изменения
+и хэш каждого исходного файла. Справочник перестраивается, только если изменился
+какой-либо файл или их набор. При повторе кода действует файл, загруженный
+в базу последним (файлы передаются в порядке загрузки load_brands.py).
+
+lookup заменяет коды на названия одним векторным сопоставлением (для категорий -
+только по категориям), поэтому сопоставление не нужно выполнять в PriceUpdate.
+Коды, которых нет в справочнике, остаются как есть.
+'''
+
+COLUMNS = ["Code", "Name", "Country"]
+
+
+def default_path():
+    """default_path - файл справочника в локальном кэше"""
+    return os.path.join(cache_dir("brands"), "makes.parquet")
+
+
+def read_makes(path):
+    """read_makes - Makes.txt в DataFrame COLUMNS (как его читает load_brands.py)"""
+    df = pd.read_csv(path, delimiter=",", encoding="ansi", header=None, usecols=[0, 1, 2],
+                     keep_default_na=False, dtype=str)
+    df.columns = COLUMNS
+    return df
+
+
+class BrandIndex:
+    """BrandIndex - справочник брендов в parquet-файле path"""
+
+    def __init__(self, path):
+        self.path = path
+        self.source = None
+        self._codes = pd.Index([], dtype=object)
+        self._names = np.empty(0, dtype=object)
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self._codes)
+
+    def load(self):
+        """load - прочитать справочник, если файл изменился с прошлого чтения"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            table = pq.read_table(self.path)
+            meta = table.schema.metadata or {}
+            self.source = json.loads(meta.get(b"source", b"null"))
+            df = table.to_pandas()
+            self._set(df)
+            self._mtime = mtime
+        return True
+
+    def _set(self, df):
+        # при повторе кода действует последняя строка, как при обновлении справочника на сервере
+        df = df.drop_duplicates("Code", keep="last")
+        self._codes = pd.Index(df["Code"].to_numpy(dtype=object))
+        self._names = df["Name"].to_numpy(dtype=object)
+
+    def _unchanged(self, files):
+        # файлы те же: совпали размер и mtime, иначе - хэш содержимого
+        old = (self.source or {}).get("files")
+        if not old or sorted(old) != sorted(files):
+            return False
+        for path, fp in files.items():
+            if old[path]["size"] != fp["size"]:
+                return False
+            if old[path]["mtime"] != fp["mtime"]:
+                fp["hash"] = file_hash(path)
+                if old[path].get("hash") != fp["hash"]:
+                    return False
+            else:
+                fp["hash"] = old[path].get("hash")
+        return True
+
+    def refresh(self, makes_paths, frames=None):
+        """refresh - перестроить справочник из всех файлов Makes, если какой-либо из них изменился
+
+        makes_paths - файлы в порядке загрузки, frames - уже прочитанные файлы {путь: DataFrame}
+        (столбцы по порядку COLUMNS), чтобы не читать их повторно.
+        """
+        frames = frames or {}
+        files = {}
+        for path in makes_paths:
+            stat = os.stat(path)
+            files[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        if self._unchanged(files):
+            return False
+
+        parts = []
+        for path, fp in files.items():
+            if fp.get("hash") is None:
+                fp["hash"] = file_hash(path)
+            df = frames.get(path)
+            if df is None:
+                df = read_makes(path)
+            else:
+                df = df.iloc[:, :3].astype(str)
+                df.columns = COLUMNS
+            parts.append(df)
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=COLUMNS, dtype=str)
+        df = df.assign(Code=df["Code"].str.strip(), Name=df["Name"].str.strip())
+        df = df[df["Code"] != ""]
+        source = {"files": files}
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({"source": json.dumps(source)})
+        tmp = self.path + ".tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, self.path)
+        with self._lock:
+            self.source = source
+            self._set(df)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        logger.info(f"Справочник брендов перестроен из файлов: {', '.join(files)}: {len(self)} кодов")
+        return True
+
+    def _resolve(self, values):
+        codes = pd.Index(values, dtype=object)
+        pos = self._codes.get_indexer(codes.str.strip() if len(codes) else codes)
+        return np.where(pos >= 0, self._names[pos], values)
+
+    def lookup(self, s):
+        """lookup - столбец кодов брендов с кодами, заменёнными на названия"""
+        with self._lock:
+            if not len(self._codes) or not len(s):
+                return s
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                # сопоставляются только категории; разные коды одного бренда сливаются в одну категорию
+                names = self._resolve(s.cat.categories.to_numpy(dtype=object))
+                uniques, inverse = np.unique(names.astype(str), return_inverse=True)
+                codes = s.cat.codes.to_numpy()
+                codes = np.where(codes >= 0, inverse[codes], -1)
+                return pd.Series(pd.Categorical.from_codes(codes, uniques), index=s.index)
+            values = s.to_numpy(dtype=object, na_value=None)
+            notna = s.notna().to_numpy()
+            out = values.copy()
+            out[notna] = self._resolve(values[notna])
+            return pd.Series(out, index=s.index).astype(s.dtype)
+
+
+# Справочники, уже прочитанные в этом процессе (разбор может идти в пуле процессов)
+_indexes = {}
+
+
+def get_index(path):
+    """get_index - справочник path, общий для процесса; перечитывается при изменении файла"""
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes[path] = BrandIndex(path)
+    else:
+        index.load()
+    return index
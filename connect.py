@@ -1,31 +1,196 @@
+import time
+import random
+import queue
+import threading
+from contextlib import contextmanager
 import pyodbc
 #import pymssql
 from loguru import logger
 
+# SQLSTATE временных ошибок: обрыв связи, таймаут, переключение реплики, взаимоблокировка
+TRANSIENT_SQLSTATES = {"08S01", "08001", "08004", "08007", "HYT00", "HYT01", "40001"}
+# Номера ошибок SQL Server, после которых стоит повторить попытку
+TRANSIENT_ERRORS = {1205, 233, 4060, 10053, 10054, 10060, 40197, 40501, 40613, 49918, 49919, 49920}
+
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 0.5
+RETRY_MAX_DELAY = 15
+
+
+def connection_string(server, database, username, password):
+    # ODBC Driver 17 for SQL Server
+    # SQL Server Native Client 11.0
+    return ("Driver={ODBC Driver 17 for SQL Server};"
+            "Server="+server+";"
+            "Database="+database+";"
+            "UID="+username+";"
+            "PWD="+password+";"
+            "Trusted_Connection=no;")
+
+
+def is_transient(err):
+    """is_transient - временная ли ошибка (имеет смысл повторить)"""
+    if not isinstance(err, pyodbc.Error):
+        return False
+    state = str(err.args[0]) if err.args else ""
+    if state in TRANSIENT_SQLSTATES:
+        return True
+    message = " ".join(str(a) for a in err.args)
+    return any(f"({code})" in message for code in TRANSIENT_ERRORS)
+
+
+def retry(func, *args, attempts=RETRY_ATTEMPTS, delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY, **kwargs):
+    """retry - вызов func с повтором при временных ошибках
+
+    Пауза растёт экспоненциально и выбирается случайно в пределах [0, delay * 2^n]
+    (не больше max_delay), чтобы параллельные загрузчики не повторяли запросы одновременно.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as err:
+            if attempt == attempts or not is_transient(err):
+                raise
+            pause = random.uniform(0, min(max_delay, delay * 2 ** attempt))
+            logger.warning(f"Временная ошибка базы данных (попытка {attempt} из {attempts}), повтор через {pause:.1f} с: {err}")
+            time.sleep(pause)
+
+
 class Sql:
     """Sql - класс подключения к базе данных
     """
     connection = False
 
-    def __init__(self, server, database, username, password):        
+    def __init__(self, server, database, username, password):
         """__init__ - инициализация подключения к базе данных """
         try:
-            # ODBC Driver 17 for SQL Server
-            # SQL Server Native Client 11.0
-            self.cnxn = pyodbc.connect("Driver={ODBC Driver 17 for SQL Server};"
-                                        "Server="+server+";"
-                                        "Database="+database+";"
-                                        "UID="+username+";"
-                                        "PWD="+password+";"
-                                        "Trusted_Connection=no;",
-                                        autocommit=True
-                                        )
+            self.cnxn = retry(pyodbc.connect, connection_string(server, database, username, password), autocommit=True)
             self.connection = True
         except BaseException as err:
             logger.error("Ошибка подключения к базе данных")
             logger.error(err)
             self.connection = False
-            
+
+    @contextmanager
+    def connection_scope(self):
+        """connection_scope - то же, что SqlPool.connection_scope, для единственного подключения"""
+        yield self.cnxn
+
     def close(self):
         if self.connection:
-            self.cnxn.close()           
+            self.cnxn.close()
+
+
+class SqlPool:
+    """SqlPool - пул подключений к базе данных
+
+    Подключение берётся на время работы (with pool.connection_scope() as cnxn) одним потоком.
+    Перед выдачей простаивавшее дольше ping_after секунд подключение проверяется запросом SELECT 1,
+    неработающие подключения закрываются и заменяются новыми. Подключения создаются с повтором
+    при временных ошибках (retry). Одновременно выдаётся не больше max_size подключений.
+    В пуле поддерживается не меньше min_size простаивающих подключений: закрытое после ошибки
+    связи подключение при возврате заменяется новым (одна попытка, без повторов).
+    """
+    connection = False
+
+    def __init__(self, server, database, username, password, min_size=1, max_size=4, ping_after=30, timeout=300):
+        self.conn_str = None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+        try:
+            missing = [name for name, value in (("server", server), ("database", database),
+                                                ("username", username), ("password", password)) if not value]
+            if missing:
+                raise ValueError(f"Не заданы параметры подключения: {', '.join(missing)}")
+            self.conn_str = connection_string(server, database, username, password)
+            for _ in range(min_size):
+                self._idle.put((self._connect(), time.monotonic()))
+            self.connection = True
+        except BaseException as err:
+            logger.error("Ошибка подключения к базе данных")
+            logger.error(err)
+            self.connection = False
+
+    def _connect(self):
+        return retry(pyodbc.connect, self.conn_str, autocommit=True)
+
+    @staticmethod
+    def _alive(cnxn):
+        try:
+            cnxn.cursor().execute("SELECT 1").fetchall()
+            return True
+        except pyodbc.Error:
+            return False
+
+    @staticmethod
+    def _discard(cnxn):
+        try:
+            cnxn.close()
+        except pyodbc.Error:
+            pass
+
+    def checkout(self):
+        """checkout - взять подключение из пула (вернуть через checkin)"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Нет свободного подключения к базе данных за {self.timeout} с")
+        try:
+            while True:
+                try:
+                    cnxn, since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - since < self.ping_after or self._alive(cnxn):
+                    return cnxn
+                logger.warning("Подключение к базе данных не отвечает, открываем новое")
+                self._discard(cnxn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, cnxn, broken=False):
+        """checkin - вернуть подключение в пул; broken - подключение после ошибки связи, закрыть"""
+        try:
+            if broken or self._closed:
+                self._discard(cnxn)
+                if not self._closed:
+                    self._replenish()
+            else:
+                self._idle.put((cnxn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _replenish(self):
+        # одна попытка: при недоступной базе возврат подключения не должен ждать повторов
+        while self._idle.qsize() < self.min_size:
+            try:
+                self._idle.put((pyodbc.connect(self.conn_str, autocommit=True), time.monotonic()))
+            except pyodbc.Error as err:
+                logger.warning(f"Не удалось восстановить подключение в пуле: {err}")
+                break
+
+    @contextmanager
+    def connection_scope(self):
+        """connection_scope - подключение из пула на время блока with"""
+        cnxn = self.checkout()
+        broken = False
+        try:
+            yield cnxn
+        except Exception as err:
+            broken = is_transient(err)
+            raise
+        finally:
+            self.checkin(cnxn, broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                cnxn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(cnxn)
@@ -0,0 +1,90 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+from loguru import logger
+
+'''
+Манифест загруженных файлов: для каждого профиля и файла хранятся размер,
+время изменения и хэш содержимого последней успешной загрузки.
+
+Неизменённый файл (тот же размер и mtime) пропускается без чтения.
+Если изменилось только mtime, считается хэш: совпал - файл тот же
+(например, скопирован повторно), меняется только запись в манифесте.
+Новый файл или файл другого размера заведомо изменён: его хэш считается
+только при необходимости (content_hash, например для кэша разобранных файлов)
+или при записи в манифест после загрузки.
+'''
+
+# Размер блока при вычислении хэша файла
+HASH_BLOCK = 1024 * 1024
+
+
+def file_hash(path):
+    """file_hash - хэш содержимого файла (blake2b), файл читается блоками"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def content_hash(fp, file_path):
+    """content_hash - хэш содержимого из отпечатка файла; считается при первом обращении"""
+    if fp.get("hash") is None:
+        fp["hash"] = file_hash(file_path)
+    return fp["hash"]
+
+
+class FileManifest:
+    """FileManifest - манифест загруженных файлов в JSON-файле"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as err:
+                logger.warning(f"Не удалось прочитать манифест {path}, файлы будут загружены заново: {err}")
+
+    @staticmethod
+    def _key(profile_id, file_path):
+        return f"{profile_id}|{os.path.abspath(file_path)}"
+
+    def fingerprint(self, profile_id, file_path):
+        """fingerprint - отпечаток файла и признак того, что он уже загружен в этом виде
+
+        Возвращает (fingerprint, unchanged). Хэш содержимого считается, только если
+        размер совпадает с записью в манифесте, а mtime - нет; иначе fingerprint["hash"] = None
+        (см. content_hash).
+        """
+        stat = os.stat(file_path)
+        fp = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": None}
+        with self.lock:
+            entry = self.entries.get(self._key(profile_id, file_path))
+        if not entry or entry["size"] != fp["size"] or not entry.get("hash"):
+            return fp, False
+        if entry["mtime"] == fp["mtime"]:
+            fp["hash"] = entry["hash"]
+            return fp, True
+        return fp, content_hash(fp, file_path) == entry["hash"]
+
+    def commit(self, profile_id, file_path, fp):
+        """commit - запомнить успешно загруженный файл и сохранить манифест"""
+        if fp.get("hash") is None:
+            stat = os.stat(file_path)
+            if (stat.st_size, stat.st_mtime_ns) != (fp["size"], fp["mtime"]):
+                # файл заменили во время загрузки: хэш был бы уже от новой версии
+                logger.warning(f"Файл {file_path} изменился во время загрузки и будет загружен снова")
+                return
+            content_hash(fp, file_path)
+        with self.lock:
+            self.entries[self._key(profile_id, file_path)] = dict(fp, loaded=datetime.now().isoformat(timespec="seconds"))
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
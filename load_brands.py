@@ -6,6 +6,10 @@ from dotenv import load_dotenv
 import configparser  # импортируем библиотеку для чтения конфигов
 from connect import Sql
 from _utils import timing_decorator, t
+import metrics
+import price_encoder
+from price_encoder import BatchSizer
+import brand_index
 
 '''
 Описание файла Makes.txt (нет строки с названием столбцов, сразу идут данные)
@@ -53,13 +57,16 @@ class BrandLoader:
 
     # Функция load_makes загрузка данных с использованием pandas DataFrame
     @timing_decorator
-    def load_makes(self, data, table, batchsize=500):
+    def load_makes(self, data, table, batchsize=None):
         logger.info('Начало загрузки данных в базу SQL')
         cursor = self.sql.cnxn.cursor()  # создаем курсор
         cursor.fast_executemany = True   # активируем быстрое выполнение
 
         # Создаем таблицу для временных данных       
+        # таблица могла остаться от загрузки прошлого файла в этой же сессии
         query = f"""
+         IF OBJECT_ID('tempdb..{table}') IS NOT NULL DROP TABLE [{table}]
+
          CREATE TABLE [{table}] (       
                [Code]     varchar(10) null,  
                [Name]     varchar(60) null,  
@@ -75,14 +82,20 @@ class BrandLoader:
 
         query = " INSERT INTO [" + table + "] ([Code], [Name], [Country]) VALUES (?, ?, ?) "
 
-        # вставляем данные в целевую таблицу
-        for i in range(0, len(data), batchsize):
-            if i+batchsize > len(data):
-                batch = data[i: len(data)].values.tolist()
-            else:
-                batch = data[i: i+batchsize].values.tolist()
-       
-            cursor.executemany(query, batch)
+        # вставляем данные в целевую таблицу; batchsize = None - размер пакета подбирается (см. BatchSizer)
+        sizer = BatchSizer()
+        if batchsize:
+            batches = price_encoder.iter_batches(data, batchsize)
+        else:
+            batches = price_encoder.iter_adaptive(data, sizer)
+        for batch in batches:
+            with metrics.span("insert", table=table) as s:
+                cursor.executemany(query, batch)
+                s.add(rows=len(batch))
+            if not batchsize:
+                sizer.observe(len(batch), s.duration)
+        if not batchsize and sizer.rate:
+            logger.info(f"Пакеты executemany: {sizer.rows} строк, скорость {sizer.rate:,.0f} строк/с")
 
         cursor.execute("exec MakesUpdate")
 
@@ -93,18 +106,28 @@ class BrandLoader:
     def process_load_makes(self):
         directory = config["LoadPath"]["MakesFile"] 
         file_list = os.listdir(directory)  # определить список всех файлов
+        loaded = {}
         for file in file_list:    
             if fnmatch.fnmatch(file, "*.txt"):       
                 logger.info('Начало обработки файла {0}'.format(file));
                 try:
-                    df = pd.read_csv(directory+file, delimiter=",", encoding='ansi', header=None, usecols=[0,1,2], keep_default_na=False);
-                    df = df.fillna("")
+                    # так же, как brand_index.read_makes: коды вида "007" остаются строками
+                    df = brand_index.read_makes(directory+file)
                       
-                    self.load_makes(data=df, table='#makes', batchsize=1000)
+                    self.load_makes(data=df, table='#makes')
+                    loaded[directory+file] = df
                     
                     logger.info('Завершение обработки файла {0}'.format(file))
                 except BaseException as err:
                     logger.error(err)
+
+        if loaded:
+            # локальный справочник для сопоставления брендов при загрузке прайсов (см. brand_index) -
+            # из всех загруженных файлов вместе
+            try:
+                brand_index.BrandIndex(brand_index.default_path()).refresh(list(loaded), loaded)
+            except Exception as err:
+                logger.error(f"Не удалось обновить справочник брендов: {err}")
                         
         logger.info('Завершили импорт')
 
@@ -1,12 +1,37 @@
 import os
+import json
+import hashlib
+import argparse
+import urllib.error
 import urllib.request
-from loguru import logger
-import configparser  # импортируем библиотеку для чтения конфигов
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
 from loguru import logger
 from dotenv import load_dotenv
 import configparser  # импортируем библиотеку для чтения конфигов
 from connect import Sql
-from _utils import timing_decorator, t
+from _utils import timing_decorator, t, cache_dir
+
+'''
+Загрузка курсов валют (XML ЦБ: ValCurs/Valute с CharCode, Nominal, Value) в базу.
+
+Запрос условный: с If-None-Match / If-Modified-Since по ETag и Last-Modified прошлого
+ответа того же адреса. Последний ответ и разобранные курсы хранятся в локальном кэше
+(cache/currency): payload.xml, rates.json, meta.json. Для адреса, отличного от
+[Currency] LoadUrl (--url, например тестовый сервер), кэш отдельный - cache/currency/url_<хэш>
+(или --cache), чтобы такой запуск не затирал кэш рабочей загрузки. Процедура LoadCurrencyRate
+вызывается, только если курсы отличаются от последних успешно загруженных в базу,
+подключение к базе в остальных случаях не открывается.
+
+--replay загружает в базу сохранённый ответ без обращения к сайту.
+CurrencyRates.to_base пересчитывает столбцы цен в базовую валюту по кэшу курсов.
+'''
+
+# Валюта, в которой заданы курсы ЦБ
+BASE_CURRENCY = "RUB"
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0"
 
 @timing_decorator
 def configure_logger():
@@ -22,7 +47,7 @@ def configure_logger():
     log_retention = config.get("log", "retention", fallback="7 days")
     log_compression = config.get("log", "compression", fallback="zip")
 
-    log_file = os.path.join(log_path, "load_brands.log") if log_path else "load_brands.log"
+    log_file = os.path.join(log_path, "load_currency.log") if log_path else "load_currency.log"
 
     logger.remove()
     logger.add(log_file, level=log_level, rotation=log_rotation, retention=log_retention, compression=log_compression)
@@ -34,46 +59,186 @@ config = configparser.ConfigParser()  # создаём объекта парсе
 config.read("..\\settings.ini")  # читаем конфиг
 
 
+def parse_rates(xml_str):
+    """parse_rates - курсы из XML ЦБ: {'date': дата, 'rates': {CharCode: рублей за единицу}}"""
+    root = ET.fromstring(xml_str)
+    rates = {BASE_CURRENCY: 1.0}
+    for valute in root.iter("Valute"):
+        code = (valute.findtext("CharCode") or "").strip()
+        value = (valute.findtext("Value") or "").strip().replace(",", ".")
+        nominal = (valute.findtext("Nominal") or "1").strip().replace(",", ".")
+        if code and value:
+            rates[code] = float(value) / float(nominal)
+    return {"date": root.get("Date"), "rates": rates}
+
+
+class CurrencyRates:
+    """CurrencyRates - курсы из локального кэша и векторный пересчёт в базовую валюту"""
+
+    def __init__(self, rates, date=None):
+        self.date = date
+        self.rates = pd.Series(rates, dtype="float64")
+
+    @classmethod
+    def load(cls, path=None):
+        """load - курсы, сохранённые последней загрузкой (rates.json в кэше)"""
+        path = path or os.path.join(cache_dir("currency"), "rates.json")
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["rates"], data.get("date"))
+
+    def to_base(self, values, currency):
+        """to_base - суммы values в валюте currency (код или столбец кодов) в базовой валюте
+
+        Для неизвестного кода валюты результат - NaN.
+        """
+        values = pd.to_numeric(values, errors="coerce")
+        if isinstance(currency, str):
+            return values * self.rates.get(currency.strip().upper(), float("nan"))
+        codes = pd.Series(currency, index=getattr(values, "index", None))
+        if isinstance(codes.dtype, pd.CategoricalDtype):
+            # курс ищется только для категорий и раздаётся по кодам
+            rates = codes.cat.categories.astype(str).str.strip().str.upper().map(self.rates).to_numpy(dtype=np.float64)
+            pos = codes.cat.codes.to_numpy()
+            factor = np.where(pos >= 0, rates[pos] if len(rates) else np.nan, np.nan)
+        else:
+            factor = codes.astype(str).str.strip().str.upper().map(self.rates).to_numpy(dtype=np.float64)
+        return values * factor
+
+
 class CurrencyLoader:
-    def __init__(self):
-        self.url = config["Currency"]["LoadUrl"]
-        
-        self.sql = Sql(
-            server=os.getenv("SERVER"),
-            database=os.getenv("DATABASE"),
-            username=os.getenv("USERNAMES"),
-            password=os.getenv("PASSWORD")
-        )
+    def __init__(self, url=None, cache_path=None):
+        load_url = config.get("Currency", "LoadUrl", fallback=None)
+        self.url = url or load_url
+        if cache_path is None:
+            if self.url == load_url:
+                cache_path = cache_dir("currency")
+            else:
+                digest = hashlib.blake2b(self.url.encode("utf-8"), digest_size=6).hexdigest()
+                cache_path = cache_dir(os.path.join("currency", f"url_{digest}"))
+        self.cache_path = cache_path
+        self.meta_path = os.path.join(self.cache_path, "meta.json")
+        self.payload_path = os.path.join(self.cache_path, "payload.xml")
+        self.rates_path = os.path.join(self.cache_path, "rates.json")
+        self.meta = {}
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, encoding="utf-8") as f:
+                    self.meta = json.load(f)
+            except (OSError, ValueError) as err:
+                logger.warning(f"Не удалось прочитать кэш курсов {self.meta_path}: {err}")
+        # подключение открывается, только когда курсы нужно загрузить в базу
+        self.sql = None
+
+    def connect(self):
+        if self.sql is None:
+            self.sql = Sql(
+                server=os.getenv("SERVER"),
+                database=os.getenv("DATABASE"),
+                username=os.getenv("USERNAMES"),
+                password=os.getenv("PASSWORD")
+            )
         if not self.sql.connection:
-            raise Exception("Не удалось подключиться к базе данных")                        
+            self.sql = None
+            raise Exception("Не удалось подключиться к базе данных")
+        return self.sql
+
+    def _save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.meta_path)
+
+    def _write(self, path, data):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
 
     def fetch_data(self):
+        """fetch_data - ответ сайта или None, если курсы не изменились с прошлого запроса (304)"""
         logger.info('Получение курсов с: ' + self.url)
-        req = urllib.request.Request(self.url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0)'
-                                                       ' Gecko/20100101 Firefox/24.0'})
-        webFile = urllib.request.urlopen(req)
-        return webFile.read()  # читаем данные с сайта
+        headers = {'User-Agent': USER_AGENT}
+        # ETag и Last-Modified хранятся по адресам; отправляются, только если сохранённый ответ - с этого адреса
+        validators = self.meta.get("validators", {}).get(self.url, {})
+        if os.path.exists(self.payload_path) and self.meta.get("url") == self.url:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        req = urllib.request.Request(self.url, headers=headers)
+        try:
+            with urllib.request.urlopen(req) as webFile:
+                data = webFile.read()  # читаем данные с сайта
+                etag, last_modified = webFile.headers.get("ETag"), webFile.headers.get("Last-Modified")
+        except urllib.error.HTTPError as err:
+            if err.code == 304:
+                logger.info("Курсы не изменились с прошлого запроса (304)")
+                return None
+            raise
+
+        self._write(self.payload_path, data)
+        self.meta.setdefault("validators", {})[self.url] = {"etag": etag, "last_modified": last_modified}
+        self.meta.update(url=self.url, hash=hashlib.blake2b(data, digest_size=16).hexdigest())
+        # ETag и Last-Modified прежнего формата кэша (без адреса)
+        self.meta.pop("etag", None)
+        self.meta.pop("last_modified", None)
+        self._save_meta()
+        return data
 
-    def load_currency(self):
-        data = self.fetch_data()
+    def cached_data(self):
+        """cached_data - последний сохранённый ответ сайта"""
+        with open(self.payload_path, "rb") as f:
+            return f.read()
+
+    def load_currency(self, replay=False, force=False):
+        """load_currency - загрузка курсов в базу, если они изменились
+
+        replay - взять сохранённый ответ без обращения к сайту,
+        force - вызвать LoadCurrencyRate, даже если эти курсы уже загружены.
+        """
+        if replay:
+            data = self.cached_data()
+        else:
+            data = self.fetch_data()
+            if data is None:
+                data = self.cached_data()
+
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
         xml_str = data.decode('windows-1251').replace('encoding="windows-1251"', '')
         logger.debug('Данные: ' + xml_str)
+        if not xml_str:
+            return False
 
-        if xml_str:
-            if self.sql.connection:
-                logger.info('Успешно подключились к базе данных')
-            else:
-                exit()
+        rates = parse_rates(xml_str)
+        tmp = self.rates_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rates, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.rates_path)
+
+        if digest == self.meta.get("loaded_hash") and not force:
+            logger.info(f"Курсы на {rates['date']} уже загружены в базу, LoadCurrencyRate не вызывается")
+            return False
 
-            logger.info('Загрузка в базу данных: начало')
-            cursor = self.sql.cnxn.cursor()  # создаем курсор
-            cursor.fast_executemany = True  # активируем быстрое выполнение
-            cursor.execute('exec LoadCurrencyRate @XMl = ?', (xml_str,))
-            cursor.commit()
-            logger.info('Загрузка в базу данных: конец')
+        sql = self.connect()
+        logger.info('Загрузка в базу данных: начало')
+        cursor = sql.cnxn.cursor()  # создаем курсор
+        cursor.execute('exec LoadCurrencyRate @XMl = ?', (xml_str,))
+        cursor.commit()
+        self.meta["loaded_hash"] = digest
+        self._save_meta()
+        logger.info(f"Загрузка в базу данных: конец (курсы на {rates['date']}: {len(rates['rates']) - 1} валют)")
+        return True
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка курсов валют")
+    parser.add_argument("--replay", action="store_true", help="загрузить сохранённый ответ без обращения к сайту")
+    parser.add_argument("--force", action="store_true", help="загрузить курсы в базу, даже если они не изменились")
+    parser.add_argument("--url", help="адрес вместо [Currency] LoadUrl (например, локальный тестовый сервер)")
+    parser.add_argument("--cache", help="каталог кэша (по умолчанию cache/currency, для --url - отдельный каталог)")
+    args = parser.parse_args()
+
     configure_logger()
-    loader = CurrencyLoader()
-    loader.load_currency()
+    loader = CurrencyLoader(url=args.url, cache_path=args.cache)
+    loader.load_currency(replay=args.replay, force=args.force)
     logger.info("Загрузка завершена")
@@ -1,15 +1,40 @@
 
 import os
 import glob
+import json
+import hashlib
 import shutil
+import tempfile
 from datetime import datetime
 import time
-import pandas as pd
 from loguru import logger
 from dotenv import load_dotenv
 import configparser  # импортируем библиотеку для чтения конфигов
-from connect import Sql
-from _utils import timing_decorator, t
+import argparse
+from itertools import groupby
+from connect import SqlPool, retry
+from profile_metadata import ProfileMetadata, PRICE_MAPPING_TYPE
+from _utils import timing_decorator, t, cache_dir, get_settings, metrics_dir
+import metrics
+import price_reader
+import price_encoder
+from price_encoder import BatchSizer, BATCH_BYTES, BATCH_SECONDS
+from price_delta import PriceSnapshot, KEY_COLUMNS, DELTA_TABLE, DELTA_PROC
+from price_reader import CHUNK_SIZE
+from price_pipeline import PricePipeline
+from price_parallel import ParallelSink, PARTITIONS
+from price_bulk import BulkSpoolSink, BcpSink
+import price_sinks
+from price_sinks import ExecutemanySink, NullSink, SqliteSink, SINKS, STAND_INS
+from file_manifest import FileManifest
+import parse_cache
+import price_watch
+import price_validate
+import price_source
+import brand_index
+import parts_index
+from parts_index import PartIndex
+from parse_cache import ParseCache
 
 load_dotenv()  # Загружаем переменные окружения из .env  
 
@@ -35,98 +60,261 @@ def configure_logger():
 
 
 class PriceLoader:
-    def __init__(self):
-        self.sql = Sql(
+    def __init__(self, chunksize=CHUNK_SIZE, delta=False, force=False, partitions=None, sink=None):
+        self.chunksize = chunksize
+        settings = get_settings()
+        self.settings = settings
+        # Способ загрузки (см. price_sinks): auto - по профилю в [sink] profile_<id> или по размеру файла
+        self.sink = sink or settings.get("sink", "default", fallback="auto")
+        # partitions > 1 - файл загружается параллельно по стольким подключениям (см. ParallelSink)
+        self.partitions = settings.getint("parallel", "partitions", fallback=0) if partitions is None else partitions
+        if self.sink == "parallel" and self.partitions < 2:
+            self.partitions = PARTITIONS
+        # Каталог частей BULK INSERT: должен быть доступен SQL Server по тому же пути
+        self.spool_dir = settings.get("bulk", "path", fallback="c:/Temp")
+        self.bulk_available = settings.has_option("bulk", "path")
+        # Размер пакетов executemany подбирается по ходу загрузки (см. BatchSizer)
+        self.batch_sizer = BatchSizer(
+            target_bytes=settings.getint("batch", "bytes_mb", fallback=BATCH_BYTES // 2**20) * 2**20,
+            target_seconds=settings.getfloat("batch", "seconds", fallback=BATCH_SECONDS)
+        )
+        self.delta = delta
+        # force - загружать файлы, даже если они не изменились с прошлой загрузки
+        self.force = force
+        self.manifest = FileManifest(os.path.join(cache_dir("manifest"), "load_prices_dynamic.json"))
+        # Кэш разобранных Excel-файлов для повторной обработки без разбора
+        max_mb = get_settings().getint("cache", "parsed_max_mb", fallback=parse_cache.MAX_MB)
+        self.parse_cache = ParseCache(cache_dir("parsed"), max_mb * 1024 * 1024)
+        # Отклонённые при проверке строки (см. price_validate)
+        self.rejects_dir = settings.get("validate", "rejects_path", fallback="") or cache_dir("rejected")
+        # Профили, в файлах которых вместо брендов коды MakeLogo: [brands] resolve = 1, 5 или * (см. brand_index)
+        resolve = settings.get("brands", "resolve", fallback="").replace(" ", "")
+        self.resolve_brands = set(resolve.split(",")) - {""}
+        self.brands_path = brand_index.default_path()
+        if self.resolve_brands and not os.path.exists(self.brands_path):
+            logger.warning(f"Справочник брендов {self.brands_path} не построен (load_brands.py), коды брендов передаются как есть")
+        # Индекс деталей для заполнения PartID на клиенте: [parts] enabled, query, refresh_seconds,
+        # window, rebuild_hours (см. parts_index)
+        self.parts = PartIndex(cache_dir("parts")) if settings.getboolean("parts", "enabled", fallback=False) else None
+        self.parts_query = settings.get("parts", "query", fallback=parts_index.QUERY)
+        self.parts_seconds = settings.getfloat("parts", "refresh_seconds", fallback=300)
+        self.parts_window = settings.getint("parts", "window", fallback=parts_index.WINDOW)
+        self.parts_rebuild = settings.getfloat("parts", "rebuild_hours", fallback=parts_index.REBUILD_SECONDS / 3600) * 3600
+        self._parts_due = 0.0
+        # Пул подключений: загрузчик и параллельные потоки берут подключение на время работы
+        self.pool = SqlPool(
             server=os.getenv("SERVER"),
             database=os.getenv("DATABASE"),
             username=os.getenv("USERNAMES"),
-            password=os.getenv("PASSWORD")
+            password=os.getenv("PASSWORD"),
+            # основное подключение и по одному на каждую часть параллельной загрузки
+            max_size=max(settings.getint("database", "pool_size", fallback=4), self.partitions + 1)
         )
-        if not self.sql.connection:
+        if not self.pool.connection:
             raise Exception("Не удалось подключиться к базе данных")
+        self.metadata = ProfileMetadata(self.pool, os.path.join(cache_dir("metadata"), f"profiles_{PRICE_MAPPING_TYPE}.json"))
         
     @timing_decorator
     def get_profiles(self):
-        query = """
-        SELECT 
-              m.MappingProfileID,
-              m.FileTypeID,
-              m.FilePath,
-              m.DelimiterID,
-              d.Brief AS DelimiterBrief,
-              d.Name AS DelimiterName,
-              m.Flag AS Flag,
-              m.BeginRow,
-              m.FileNames
-         FROM tMappingProfiles m WITH (NOLOCK)
-         LEFT JOIN tDelimiter d WITH (NOLOCK)
-                ON d.DelimiterID = m.DelimiterID
-        WHERE m.MappingTypeID = 15 
-          AND m.isActive = 1
-        """
-        cursor = self.sql.cnxn.cursor()
-        cursor.execute(query)
-        columns = [column[0] for column in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        """get_profiles - активные профили прайсов (см. ProfileMetadata: один запрос версии при неизменных профилях)"""
+        return self.metadata.profiles()
 
     def get_mapping_fields(self, profile_id):
-        query = f"""
-        SELECT 
-               t.MappingProfileID,
-               t.MappingGroup,
-               f.FieldID,
-               f.Brief AS FieldBrief,
-               f.Name AS FieldName,
-               f.DataType AS FieldDataType,
-               t.DataType,
-               t.DataValue,
-               t.Flag
-          FROM tMappingFields t WITH (NOLOCK)
-          LEFT JOIN tFields f WITH (NOLOCK) 
-                 ON f.FieldID = t.FieldID
-         WHERE t.MappingProfileID = {profile_id}
-        """
-        cursor = self.sql.cnxn.cursor()
-        cursor.execute(query)
-        columns = [column[0] for column in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        """get_mapping_fields - поля маппинга профиля из загруженных вместе с профилями метаданных"""
+        return self.metadata.fields(profile_id)
     
-    @timing_decorator
-    def load_prices(self, df, batchsize=100000):
-        logger.info(f'{df.shape[0]} строк для загрузки в pPrice')
-        # logger.info(f'{df.shape[1]} столбцов для загрузки в pPrice')
-        # logger.info(f'{df[5:]}')
-        cursor = self.sql.cnxn.cursor()
-        cursor.fast_executemany = True
+    def insert_prices(self, cursor, df, batchsize=None, kinds=None, table="pPrice"):
+        """insert_prices - пакетная вставка строк DataFrame в table через executemany (без очистки и PriceUpdate)
 
-        # Удаляем текущие записи
-        cursor.execute("DELETE FROM pPrice")
-        
-        # Подготовка SQL-запроса
-        cols = list(df.columns)
-        placeholders = ', '.join(['?'] * len(cols))
-        colnames = ', '.join(cols)
-        insert_sql = f"INSERT INTO pPrice ({colnames}) VALUES ({placeholders})"
-
-        # data = df[cols].values.tolist()
-        data = [[None if pd.isna(v) else v for v in row] for row in df[cols].values.tolist()]
+        kinds - типы полей по tFields.DataType (price_encoder.field_kinds), по ним приводятся столбцы.
+        batchsize = None - размер пакета подбирает self.batch_sizer по памяти и времени пакетов.
+        """
+        with ExecutemanySink(cursor, kinds, table, self.batch_sizer, batchsize) as sink:
+            return sink.write(df)
 
-        logger.info(f"Начало пакетной загрузки данных в pPrice, всего строк: {len(data)}")
+    def price_update(self, cursor):
+        # Обновляем или перерасчитываем
+        with metrics.span("PriceUpdate") as s:
+            cursor.execute("EXEC PriceUpdate")
+        logger.info(f"Выполнена процедура PriceUpdate. Время выполнения: {t(s.duration)}")
 
-        for i in range(0, len(data), batchsize):
-            batch = data[i:i+batchsize]
-            cursor.executemany(insert_sql, batch)
-            logger.info(f"Загружено строк: {i+len(batch)}")
+    @timing_decorator
+    def load_prices(self, df, kinds=None, sink=None):
+        """load_prices - загрузка готового DataFrame в pPrice и PriceUpdate
 
-        logger.info("Данные загружены в pPrice")
+        sink - способ загрузки, по умолчанию заданный загрузчику или выбранный по числу строк.
+        """
+        logger.info(f'{df.shape[0]} строк для загрузки в pPrice')
+        name = sink or self.sink
+        if name == "auto":
+            name = price_sinks.choose_sink(len(df), self.partitions, self.bulk_available)
+        with self.pool.connection_scope() as cnxn:
+            return self.load_stream(cnxn, [df], kinds, name)
+
+    def sink_name(self, job):
+        """sink_name - способ загрузки файла: заданный загрузчику, из [sink] profile_<id> или по оценке размера файла"""
+        if self.sink != "auto":
+            return self.sink
+        name = self.settings.get("sink", f"profile_{job['profile_id']}", fallback="auto")
+        if name != "auto":
+            return name
+        rows = price_sinks.estimate_rows(job)
+        name = price_sinks.choose_sink(rows, self.partitions, self.bulk_available)
+        logger.info(f"Способ загрузки файла {os.path.basename(job['file_path'])}: {name} (оценка строк: {rows})")
+        return name
+
+    def open_sink(self, name, cnxn, kinds):
+        """open_sink - объект загрузки name (см. price_sinks) на подключении cnxn"""
+        if name == "executemany":
+            return ExecutemanySink(cnxn.cursor(), kinds, sizer=self.batch_sizer)
+        if name == "parallel":
+            return ParallelSink(self.pool, cnxn.cursor(), max(self.partitions, 2), kinds)
+        if name == "bulk":
+            return BulkSpoolSink(cnxn, self.spool_dir)
+        if name == "bcp":
+            # bcp читает части на стороне клиента, поэтому подходит локальный временный каталог
+            return BcpSink(cnxn, tempfile.gettempdir(), os.getenv("SERVER"), os.getenv("DATABASE"),
+                           os.getenv("USERNAMES"), os.getenv("PASSWORD"))
+        if name == "null":
+            return NullSink(kinds)
+        if name == "sqlite":
+            return SqliteSink(self.settings.get("sink", "sqlite_path", fallback=os.path.join(cache_dir("sqlite"), "pPrice.db")), kinds)
+        raise ValueError(f"Неизвестный способ загрузки: {name}, допустимы {', '.join(SINKS)}")
+
+    def load_stream(self, cnxn, chunks, kinds, name, snapshot=None):
+        """load_stream - загрузка частей способом name: очистка таблицы, строки, PriceUpdate"""
+        cursor = cnxn.cursor()
+        total = 0
+        sink = self.open_sink(name, cnxn, kinds)
+        with sink:
+            if sink.clear_sql:
+                cursor.execute(sink.clear_sql)
+            for df_ready in chunks:
+                if snapshot is not None:
+                    # первая загрузка профиля: запоминаем строки для следующего раза
+                    snapshot.diff(df_ready)
+                sink.write(df_ready)
+                total += len(df_ready)
+                logger.info(f"Загружено строк: {total}")
+
+        logger.info(f"Данные загружены в pPrice ({name}), всего строк: {total}")
+        if sink.target_db:
+            self.price_update(cursor)
+        return total
+
+    def parse_file(self, job):
+        """parse_file - чтение и маппинг файла, генератор готовых к загрузке частей"""
+        return price_reader.parse_file(job, self.chunksize, self.parse_cache)
+
+    def snapshot_path(self, job):
+        """snapshot_path - файл снимка: у каждого файла профиля (и набора файлов из архива) свой снимок"""
+        source = json.dumps([job["file_path"], job.get("members")], ensure_ascii=False)
+        digest = hashlib.blake2b(source.encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(cache_dir("delta"), f"profile_{job['profile_id']}_{digest}.parquet")
+
+    def drop_snapshots(self, profile_id):
+        """drop_snapshots - удалить снимки профиля: после полной загрузки они не соответствуют данным сервера"""
+        delta_dir = cache_dir("delta")
+        paths = glob.glob(os.path.join(delta_dir, f"profile_{profile_id}_*.parquet"))
+        # снимок на весь профиль, как его хранили прежние версии
+        paths.append(os.path.join(delta_dir, f"profile_{profile_id}.parquet"))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"Снимок инкрементальной загрузки удалён: {path}")
+
+    def get_snapshot(self, job):
+        """get_snapshot - снимок файла для инкрементальной загрузки или None, если она невозможна
+
+        Способ загрузки файла должен быть уже выбран (job["sink"]): при загрузке без базы
+        снимок не создаётся, иначе следующая настоящая загрузка пропустила бы строки.
+        """
+        if not self.delta or job["sink"] in STAND_INS:
+            return None
+        if not PriceSnapshot.supports(job["field_map"]):
+            logger.warning(f"Профиль {job['profile_id']}: в маппинге нет полей {KEY_COLUMNS}, инкрементальная загрузка невозможна")
+            return None
+        return PriceSnapshot(self.snapshot_path(job))
+
+    def load_chunks(self, job, chunks):
+        """load_chunks - загрузка готовых частей файла в pPrice и PriceUpdate
+
+        pPrice очищается один раз перед первой частью, PriceUpdate выполняется один раз на файл.
+        Способ загрузки выбирается для каждого файла (sink_name), выбранный записывается в job["sink"].
+        В инкрементальном режиме при наличии снимка файла загружаются только изменения (load_delta).
+        Полная загрузка без инкрементального режима удаляет снимки профиля (drop_snapshots).
+        """
+        job["sink"] = self.sink_name(job)
+        snapshot = self.get_snapshot(job)
+        if snapshot is not None and snapshot.exists:
+            return self.load_delta(job, chunks, snapshot)
+
+        kinds = price_encoder.field_kinds(job["field_map"])
+        with self.pool.connection_scope() as cnxn:
+            total = self.load_stream(cnxn, chunks, kinds, job["sink"], snapshot)
+        if snapshot is not None:
+            snapshot.save()
+        elif not self.delta and job["sink"] not in STAND_INS:
+            self.drop_snapshots(job["profile_id"])
+        return total
 
-        # Обновляем или перерасчитываем
-        cursor.execute("EXEC PriceUpdate")
-        logger.info("Выполнена процедура PriceUpdate")
+    @timing_decorator
+    def load_delta(self, job, chunks, snapshot):
+        """load_delta - инкрементальная загрузка: в DELTA_TABLE уходят только новые, изменённые и удалённые строки"""
+        with self.pool.connection_scope() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.fast_executemany = True
+            cursor.execute(f"DELETE FROM {DELTA_TABLE}")
+
+            kinds = price_encoder.field_kinds(job["field_map"])
+            total = 0
+            changed = 0
+            for df_ready in chunks:
+                total += len(df_ready)
+                df_delta = snapshot.diff(df_ready)
+                changed += self.insert_prices(cursor, df_delta, kinds=kinds, table=DELTA_TABLE)
+
+            df_deleted = snapshot.deleted()
+            self.insert_prices(cursor, df_deleted, kinds=kinds, table=DELTA_TABLE)
+            logger.info(f"Инкрементальная загрузка: строк в файле {total}, новых и изменённых {changed}, удалённых {len(df_deleted)}")
+
+            with metrics.span(DELTA_PROC) as s:
+                cursor.execute(f"EXEC {DELTA_PROC}")
+            logger.info(f"Выполнена процедура {DELTA_PROC}. Время выполнения: {t(s.duration)}")
+        snapshot.save()
+        return total
 
     @timing_decorator
-    def process_all_profiles(self):
-        profiles = self.get_profiles()
+    def load_file(self, job):
+        """load_file - потоковая загрузка файла в pPrice
+
+        Файл читается частями, каждая часть сразу маппится и отправляется в pPrice,
+        поэтому пиковая память не зависит от размера файла.
+        """
+        return self.load_chunks(job, self.parse_file(job))
+
+    def refresh_parts(self):
+        """refresh_parts - догрузить новые детали в индекс PartID (не чаще раза в parts_seconds)"""
+        if self.parts is None or time.monotonic() < self._parts_due:
+            return
+        self._parts_due = time.monotonic() + self.parts_seconds
+        try:
+            retry(self.parts.refresh, self.pool, self.parts_query, self.parts_window, self.parts_rebuild)
+        except Exception as ex:
+            # загрузка продолжается с имеющимся индексом, ненайденные детали определит PriceUpdate
+            logger.warning(f"Не удалось обновить индекс деталей: {ex}")
+
+    def get_file_jobs(self, profiles=None, accept=None):
+        """get_file_jobs - генератор заданий на загрузку: по одному на каждый найденный файл профиля
+
+        Файлы, которые уже загружены в том же виде (см. FileManifest), пропускаются, если не задан force.
+        profiles - уже прочитанные профили (по умолчанию get_profiles),
+        accept(key, file_path) - отбор файлов, например готовых к загрузке (см. price_watch.StableFiles).
+        """
+        skipped = 0
+        if profiles is None:
+            profiles = self.get_profiles()
+        parts = None
         for profile in profiles:
             profile_id = profile["MappingProfileID"]
             file_type  = profile["FileTypeID"]
@@ -135,6 +323,17 @@ class PriceLoader:
             delimiterName  = profile["DelimiterName"]
             has_header = ((profile.get("Flag") or 0) & 1) > 0
 
+            # сжатые файлы и архивы zip по маске читаются без распаковки на диск (см. price_source)
+            members = dict(price_source.match_files(path_mask, file_type))
+            matched_files = list(members)
+            if accept is not None:
+                matched_files = [f for f in matched_files if accept((profile_id, f), f)]
+                if not matched_files:
+                    continue
+            elif not matched_files:
+                logger.warning(f"Файлы не найдены по маске {path_mask}")
+                continue
+
             mapping = self.get_mapping_fields(profile_id)
             if not mapping:
                 logger.warning(f"Нет маппинга для профиля {profile_id}")
@@ -151,31 +350,9 @@ class PriceLoader:
             }
             
             # logger.info(f"Профиль field_map\n{field_map}")
-
-            # Подготовим типы данных для pandas
-            dtype_map = {}
-            for field, meta in field_map.items():
-                if meta["DataValue"] is not None:
-                    try:
-                        idx = int(meta["DataValue"]) - 1
-                        ftype = meta["FieldDataType"].lower()
-
-                        if idx >= 0:
-                            if "char" in ftype or "text" in ftype or ftype == "str":
-                                dtype_map[idx] = str
-                            elif "float" in ftype or "real" in ftype or "decimal" in ftype or "numeric" in ftype:
-                                dtype_map[idx] = float
-                            elif "int" in ftype:
-                                dtype_map[idx] = float
-                    except Exception as e:
-                        logger.warning(f"Ошибка при формировании dtype для поля {field}: {e}")
-
-            # logger.info(f"Профиль dtype_map\n{dtype_map}")
-
-            matched_files = glob.glob(path_mask)
-            if not matched_files:
-                logger.warning(f"Файлы не найдены по маске {path_mask}")
-                continue
+            rules = price_validate.load_rules(self.settings, profile_id)
+            resolve = "*" in self.resolve_brands or str(profile_id) in self.resolve_brands
+            brands = self.brands_path if resolve and os.path.exists(self.brands_path) else None
 
             logger.info(f"Обработка профиля {profile_id} с файлами: {matched_files}")           
             logger.info(f"Используемый разделитель: {delimiterName}")
@@ -183,72 +360,80 @@ class PriceLoader:
             logger.info(f"file_type: {file_type}")
             folder = os.path.dirname(path_mask) + os.sep
 
+            if parts is None and self.parts is not None:
+                self.refresh_parts()
+                parts = self.parts.path if len(self.parts) else ""
+
             for file_path in matched_files:
-                file = os.path.basename(file_path)
-                try:
-                    logger.info(f"Чтение файла: {file_path}")
-                    if file_type == 0:
-                        df_raw = pd.read_csv(
-                            file_path,
-                            delimiter=delimiter,
-                            header=0 if has_header else None,
-                            encoding="ansi",
-                            low_memory=False
-                        )
-                    else:
-                        df_raw = pd.read_excel(
-                            file_path,
-                            header=0 if has_header else None
-                        )
-
-                    # df_raw = df_raw.fillna("")
-                    df_raw = df_raw[df_raw['DetailNum'] != '']
-                    # df_raw = df_raw.where(pd.notna(df_raw), None)
-                    # logger.info(f"{df_raw}")
-
-                    df_ready = pd.DataFrame()
-
-                    for field, meta in field_map.items():
-                        dtype = meta["MappingDataType"]
-                        ftype = meta["FieldDataType"].lower()
-                        val   = meta["DataValue"]
-
-                        if dtype == 0:
-                            try:
-                                idx = int(val) - 1
-                                if idx >= df_raw.shape[1]:
-                                    logger.error(f"Индекс {val} для поля '{field}' выходит за пределы столбцов")
-                                    raise IndexError(f"Индекс {val} для '{field}' недопустим")
-                              
-                                # if ftype in ["float", "real", "decimal", "numeric", "int"]:
-                                    # df_ready[field] = pd.to_numeric(df_raw.iloc[:, idx], errors="coerce")
-                                # elif ftype in ["varchar", "nvarchar", "text", "char", "str"]:
-                                df_ready[field] = df_raw.iloc[:, idx] #.astype(str)
-                                # df_ready[field] = df_raw.iloc[:, idx].replace("", None).astype(ftype)
-                            except Exception as e:
-                                logger.error(f"Ошибка чтения столбца {val} для поля {field} в файле {file}: {e}")
-                                raise
-                        elif dtype == 1:
-                            df_ready[field] = [val] * len(df_raw)
-
-                        # Приведение к правильному типу
-                        # if field in dtype_map:
-                        #     try:
-                        #         df_ready[field] = df_ready[field].astype(dtype_map[field])
-                        #     except Exception as e:
-                        #         logger.warning(f"Не удалось привести {field} к {dtype_map[field]}: {e}")
-
-                    if "DetailNum" in df_ready.columns:
-                        df_ready = df_ready[df_ready["DetailNum"].notna() & (df_ready["DetailNum"] != "")]
-
-                    # logger.info(f"Готово к загрузке:\n{df_ready.head(5)}")
-                    self.load_prices(df_ready)
-                    # self.archive_file(folder, file)
-                    logger.success(f"Файл обработан: {file}")
-
-                except Exception as ex:
-                    logger.error(f"Ошибка при обработке файла {file} профиля {profile_id}: {ex}")
+                fingerprint, unchanged = self.manifest.fingerprint(profile_id, file_path)
+                if unchanged and not self.force:
+                    logger.info(f"Файл не изменился с прошлой загрузки, пропускаем: {file_path}")
+                    skipped += 1
                     continue
+                yield {
+                    "profile_id": profile_id,
+                    "file_path": file_path,
+                    "members": members[file_path],
+                    "file_type": file_type,
+                    "delimiter": delimiter,
+                    "has_header": has_header,
+                    "begin_row": profile.get("BeginRow"),
+                    "field_map": field_map,
+                    "folder": folder,
+                    "fingerprint": fingerprint,
+                    "validate": rules,
+                    "brands": brands,
+                    "parts": parts,
+                    "rejects_path": os.path.join(self.rejects_dir, f"profile_{profile_id}_{os.path.basename(file_path)}.parquet"),
+                }
+
+        if skipped or accept is None:
+            logger.info(f"Пропущено неизменённых файлов: {skipped}")
+
+    def file_span(self, job):
+        """file_span - интервал метрик загрузки файла (размер файла - в bytes)"""
+        span = metrics.span("file", profile_id=job["profile_id"], file=os.path.basename(job["file_path"]))
+        return span.add(bytes=job["fingerprint"]["size"] if job.get("fingerprint") else 0)
+
+    def file_done(self, job):
+        """file_done - действия после успешной загрузки файла (job["loaded"] - отметка для price_watch)"""
+        job["loaded"] = True
+        if job.get("sink") in STAND_INS:
+            return
+        self.manifest.commit(job["profile_id"], job["file_path"], job["fingerprint"])
+        # self.archive_file(job["folder"], os.path.basename(job["file_path"]))
+
+    @timing_decorator
+    def process_all_profiles(self, workers=0, processes=False, jobs=None):
+        """process_all_profiles - загрузка всех файлов всех активных профилей
+
+        workers = 0 - файлы читаются и загружаются последовательно,
+        workers > 0 - разбор следующих файлов идёт параллельно с загрузкой текущего (см. PricePipeline),
+        processes = True - разбор в пуле процессов (workers = 0 - по числу ядер).
+        jobs - готовые задания вместо get_file_jobs (резидентный режим, см. price_watch).
+        """
+        if jobs is None:
+            jobs = self.get_file_jobs()
+        if workers or processes:
+            PricePipeline(self, workers=workers, processes=processes).run(jobs)
+            return
+
+        for profile_id, profile_jobs in groupby(jobs, key=lambda job: job["profile_id"]):
+            with metrics.span("profile", profile_id=profile_id):
+                for job in profile_jobs:
+                    file = os.path.basename(job["file_path"])
+                    try:
+                        with self.file_span(job) as s:
+                            logger.info(f"Чтение файла: {job['file_path']}, размер части: {self.chunksize}")
+                            # файл загружается заново целиком (pPrice очищается в начале), поэтому после
+                            # обрыва связи или переключения сервера загрузку файла можно повторить
+                            s.add(rows=retry(self.load_file, job))
+                            self.file_done(job)
+                        logger.success(f"Файл обработан: {file}")
+
+                    except Exception as ex:
+                        logger.error(f"Ошибка при обработке файла {file} профиля {job['profile_id']}: {ex}")
+                        continue
 
     @timing_decorator            
     def archive_file(self, folder, file):
@@ -259,7 +444,34 @@ class PriceLoader:
         logger.info(f"Файл перемещён в архив: {file}")
         
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка прайсов по настроенному маппингу")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="размер части файла, строк (0 - читать целиком)")
+    parser.add_argument("--workers", type=int, default=0, help="число потоков разбора файлов параллельно с загрузкой (0 - последовательно)")
+    parser.add_argument("--processes", action="store_true", help="разбирать файлы в пуле процессов (по умолчанию по числу ядер)")
+    parser.add_argument("--delta", action="store_true", help=f"инкрементальная загрузка: только изменения через {DELTA_TABLE}")
+    parser.add_argument("--force", action="store_true", help="загружать и неизменённые с прошлой загрузки файлы")
+    parser.add_argument("--sink", choices=("auto",) + SINKS, default=None, help="способ загрузки (по умолчанию [sink] default или auto - по размеру файла)")
+    parser.add_argument("--partitions", type=int, default=None, help="загружать файл параллельно по стольким подключениям (по умолчанию [parallel] partitions)")
+    parser.add_argument("--watch", action="store_true", help="резидентный режим: загружать файлы по мере появления (см. price_watch)")
+    args = parser.parse_args()
+
     # configure_logger()
-    loader = PriceLoader()
-    loader.process_all_profiles()
+    if args.watch:
+        settings = get_settings()
+        interval = settings.getfloat("watch", "interval", fallback=price_watch.INTERVAL)
+        loader = PriceLoader(chunksize=args.chunksize or None, delta=args.delta, force=args.force, partitions=args.partitions, sink=args.sink)
+        watcher = price_watch.PriceWatcher(
+            loader, interval=interval,
+            settle=settings.getfloat("watch", "settle", fallback=price_watch.SETTLE),
+            profiles_seconds=settings.getfloat("watch", "profiles_seconds", fallback=price_watch.PROFILES_SECONDS),
+            workers=args.workers, processes=args.processes, tasks=price_watch.settings_tasks(interval),
+            retry=settings.getfloat("watch", "retry", fallback=price_watch.RETRY)
+        )
+        watcher.run()
+    else:
+        metrics.start_run("load_prices_dynamic", metrics_dir())
+        loader = PriceLoader(chunksize=args.chunksize or None, delta=args.delta, force=args.force, partitions=args.partitions, sink=args.sink)
+        loader.process_all_profiles(workers=args.workers, processes=args.processes)
+        metrics.end_run()
+    loader.pool.close()
     logger.info("Загрузка завершена")
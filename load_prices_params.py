@@ -4,7 +4,7 @@ import pandas as pd
 from loguru import logger
 import configparser  # импортируем библиотеку для чтения конфигов
 from dotenv import load_dotenv
-from connect import Sql
+from load_prices_dynamic import PriceLoader
 import time
 import sys
 
@@ -42,16 +42,15 @@ directory = config["LoadPath"]["PriceFile"]
 
 file_list = os.listdir(directory)  # определить список всех файлов
 if file_list:
-    sql = Sql(
-            server=os.getenv("SERVER"),
-            database=os.getenv("DATABASE"),
-            username=os.getenv("USERNAMES"),
-            password=os.getenv("PASSWORD")
-    )
-    if sql.connection:
-        logger.info('Успешно подключились к базе данных')
-    else:
-        exit()
+    # загрузка в pPrice и PriceUpdate - как в load_prices_dynamic.py, способ по [sink] default или числу строк
+    loader = PriceLoader()
+    logger.info('Успешно подключились к базе данных')
+
+# Столбцы файла -> поля pPrice и их типы (см. price_encoder.field_kinds)
+COLUMNS = {"MakeLogo": "Brand", "RESTR": "Restrictions"}
+KINDS = {"Brand": "str", "DetailNum": "str", "DetailPrice": "float", "DetailName": "str", "PriceLogo": "str",
+         "Quantity": "int", "PackQuantity": "int", "Reliability": "float", "WeightKG": "float", "VolumeKG": "float",
+         "Restrictions": "str", "MOSA": "float"}
 
 for file in file_list: 
     if fnmatch.fnmatch(file, sys.argv[1]): #  EMIR FAST 
@@ -75,17 +74,18 @@ for file in file_list:
             toc = time.perf_counter()
             logger.info(f'Загрузили файл {file} в объект DataFrame. Время выполнения  {toc - tic:0.4f}')
             
-            sql.load_prices(data=df, batchsize=100000)
+            loader.load_prices(df.rename(columns=COLUMNS), kinds=KINDS)
             # df = df[0:0]   
             df.iloc[0:0]         
             toc = time.perf_counter()
             logger.info(f"Завершение обработки файла {file}. Вычисление заняло {toc - tic:0.4f}")
             processed = True
 
-            sql.close()
         except BaseException as err:
             processed = False
             logger.error(err)
-            sql.close()
 
+# подключение общее для всех файлов, закрываем после обработки последнего
+if file_list:
+    loader.pool.close()
 logger.info('Завершили импорт')
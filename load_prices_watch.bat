@@ -0,0 +1,6 @@
+@echo off
+>C:\Logs\load_prices_watch_cmd.txt 2>&1(
+  cd c:\Services\prod\LoadPrices\
+  call .\.venv\Scripts\activate
+  python load_prices_dynamic.py --watch
+) 
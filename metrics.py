@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from datetime import datetime
+from loguru import logger
+
+'''
+Метрики этапов загрузки: вложенные интервалы (span) с длительностью, числом строк,
+объёмом данных и изменением памяти процесса.
+
+    metrics.start_run("load_prices_dynamic", path)
+    with metrics.span("file", profile_id=1, file="48H.txt") as s:
+        ...
+        s.add(rows=len(df))
+
+Интервал, открытый внутри другого (в том же потоке или генераторе), записывается
+как дочерний. Закрытые интервалы дописываются строками JSON в файл запуска
+run_<время>_<pid>.jsonl. Пока запуск не начат (например, в процессах-обработчиках),
+интервалы только измеряют время и никуда не пишутся.
+'''
+
+_current = contextvars.ContextVar("metrics_span", default=None)
+_run = None
+
+# Маркер конца итерации в iter_spans
+_END = object()
+
+
+def current_rss():
+    """current_rss - текущий объём памяти процесса (resident set), байт"""
+    if sys.platform == "win32":
+        return _win_memory().WorkingSetSize
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss()
+
+
+def peak_rss():
+    """peak_rss - пиковый объём памяти процесса, байт"""
+    if sys.platform == "win32":
+        return _win_memory().PeakWorkingSetSize
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux - в КБ, macOS - в байтах
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _win_memory():
+    import ctypes
+    from ctypes import wintypes
+
+    class Counters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = Counters()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                             ctypes.byref(counters), counters.cb)
+    return counters
+
+
+class Run:
+    """Run - файл метрик одного запуска"""
+
+    def __init__(self, name, path):
+        os.makedirs(path, exist_ok=True)
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.file_path = os.path.join(path, f"run_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.jsonl")
+        self._file = open(self.file_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(dict(record, run=self.id, job=self.name), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def start_run(name, path):
+    """start_run - начать запись метрик запуска в каталог path"""
+    global _run
+    if _run is not None:
+        _run.close()
+    _run = Run(name, path)
+    logger.info(f"Метрики запуска пишутся в {_run.file_path}")
+    return _run
+
+
+def end_run():
+    """end_run - закончить запись метрик"""
+    global _run
+    if _run is not None:
+        _run.close()
+        _run = None
+
+
+class Span:
+    """Span - интервал работы этапа (см. span)"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.id = uuid.uuid4().hex[:12]
+        self.parent = None
+        self.rows = 0
+        self.bytes = 0
+        self.duration = None
+        self._token = None
+        self._skip = False
+
+    def add(self, rows=0, bytes=0):
+        """add - учесть обработанные строки и байты"""
+        self.rows += rows
+        self.bytes += bytes
+        return self
+
+    def skip(self):
+        """skip - не записывать интервал"""
+        self._skip = True
+
+    def __enter__(self):
+        parent = _current.get()
+        self.parent = parent.id if parent is not None else None
+        self._token = _current.set(self)
+        self._started = datetime.now()
+        self._mem = current_rss()
+        self._tic = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._tic
+        _current.reset(self._token)
+        if _run is not None and not self._skip:
+            mem = current_rss()
+            _run.write({
+                "span": self.id,
+                "parent": self.parent,
+                "name": self.name,
+                "start": self._started.isoformat(timespec="milliseconds"),
+                "duration": round(self.duration, 6),
+                "rows": self.rows,
+                "bytes": self.bytes,
+                "mem": mem,
+                "mem_delta": mem - self._mem,
+                "thread": threading.current_thread().name,
+                "error": None if exc is None else f"{exc_type.__name__}: {exc}",
+                **self.attrs,
+            })
+        return False
+
+
+def span(name, **attrs):
+    """span - интервал этапа name с атрибутами attrs (профиль, файл и т.п.)"""
+    return Span(name, **attrs)
+
+
+def iter_spans(name, iterable, **attrs):
+    """iter_spans - элементы iterable, получение каждого записывается интервалом name
+
+    Число строк интервала - len(элемента), если он его поддерживает.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            with span(name, **attrs) as s:
+                item = next(iterator, _END)
+                if item is _END:
+                    s.skip()
+                elif hasattr(item, "__len__"):
+                    s.add(rows=len(item))
+            if item is _END:
+                return
+            yield item
+    finally:
+        # недочитанный источник (генератор) закрываем сразу, а не при сборке мусора
+        if hasattr(iterator, "close"):
+            iterator.close()
+
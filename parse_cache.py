@@ -0,0 +1,183 @@
+import os
+import json
+import uuid
+import hashlib
+import pyarrow as pa
+from loguru import logger
+import price_encoder
+from file_manifest import content_hash
+
+'''
+Кэш разобранных файлов: результат чтения и маппинга файла в формате Arrow IPC.
+
+Ключ - хэш содержимого файла и версия маппинга (поля профиля, тип файла,
+заголовок, разделитель), поэтому повторная обработка того же файла с тем же
+маппингом (например, после ошибки на стороне базы) не требует разбора Excel.
+Размер кэша ограничен: при превышении удаляются давно не использованные записи.
+
+Запись пишется по частям по мере разбора (CacheWriter): в файле по пакету записей
+на часть, разобранный файл целиком в памяти не собирается. Схема записи задаётся
+типами полей маппинга (строки, числа float64), поэтому части с разным компактным
+представлением (см. price_reader.compact_column) помещаются в один файл.
+При чтении части отдаются по одной.
+'''
+
+# Меняется при изменении логики чтения/маппинга, чтобы не использовать старые записи
+PARSE_VERSION = 2
+
+# Предельный размер кэша по умолчанию, МБ
+MAX_MB = 2048
+
+
+def cache_key(job):
+    """cache_key - ключ кэша для задания: хэш файла + версия маппинга"""
+    spec = {
+        "version": PARSE_VERSION,
+        "file_type": job["file_type"],
+        "has_header": job["has_header"],
+        "begin_row": job.get("begin_row"),
+        "delimiter": job["delimiter"],
+        "field_map": job["field_map"],
+    }
+    if job.get("members"):
+        # из архива читаются только файлы, подходящие под маску профиля
+        spec["members"] = job["members"]
+    mapping = json.dumps(spec, sort_keys=True, default=str)
+    mapping_hash = hashlib.blake2b(mapping.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{content_hash(job['fingerprint'], job['file_path'])}_{mapping_hash}"
+
+
+def column_type(kind):
+    """column_type - тип Arrow столбца записи по классу типа поля (см. price_encoder.field_kind)"""
+    return pa.float64() if kind in ("float", "int") else pa.string()
+
+
+class CacheWriter:
+    """CacheWriter - запись разобранного файла в кэш по частям
+
+    Пишет во временный файл; commit переносит его на место записи, abort удаляет.
+    """
+
+    def __init__(self, cache, key, field_map):
+        self.cache = cache
+        self.path = cache._file(key)
+        self.tmp = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        self.kinds = price_encoder.field_kinds(field_map)
+        self.schema = None
+        self._sink = None
+        self._writer = None
+
+    def write(self, df):
+        table = price_encoder.to_arrow(df)
+        if self._writer is None:
+            self.schema = pa.schema([pa.field(name, column_type(self.kinds.get(name))) for name in table.column_names])
+            self._sink = pa.OSFile(self.tmp, "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+        self._writer.write_table(table.select(self.schema.names).cast(self.schema))
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+
+    def commit(self):
+        """commit - запись готова: файл переносится в кэш, старые записи вытесняются"""
+        if self.schema is None:
+            return
+        try:
+            self._close()
+            os.replace(self.tmp, self.path)
+        finally:
+            self.cache._remove(self.tmp)
+        self.cache.evict()
+
+    def abort(self):
+        """abort - разбор не завершён: временный файл удаляется"""
+        try:
+            self._close()
+        finally:
+            self.cache._remove(self.tmp)
+
+
+class ParseCache:
+    """ParseCache - кэш разобранных файлов в каталоге path не больше max_bytes"""
+
+    def __init__(self, path, max_bytes=MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.arrow")
+
+    def get(self, key):
+        """get - генератор частей разобранного файла (DataFrame) или None, если в кэше его нет"""
+        path = self._file(key)
+        source = None
+        try:
+            source = pa.memory_map(path)
+            reader = pa.ipc.open_file(source)
+        except FileNotFoundError:
+            return None
+        except (OSError, pa.ArrowInvalid) as err:
+            if source is not None:
+                source.close()
+            logger.warning(f"Повреждённая запись кэша {path} удалена: {err}")
+            self._remove(path)
+            return None
+        # Время изменения - отметка последнего использования для вытеснения
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self._batches(source, reader)
+
+    @staticmethod
+    def _batches(source, reader):
+        with source:
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+
+    def writer(self, key, field_map):
+        """writer - CacheWriter для записи key; типы столбцов - по field_map"""
+        return CacheWriter(self, key, field_map)
+
+    def put(self, key, df, field_map):
+        """put - сохранить разобранный файл одной частью и вытеснить старые записи сверх лимита"""
+        writer = self.writer(key, field_map)
+        try:
+            writer.write(df)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def evict(self):
+        """evict - удалить давно не использованные записи, пока кэш больше max_bytes
+
+        Кэшем могут одновременно пользоваться несколько процессов, поэтому
+        уже удалённые другим процессом записи просто пропускаются.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".arrow"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.path, name))
+            total -= size
+            logger.info(f"Из кэша разобранных файлов вытеснена запись {name}")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,198 @@
+import os
+import json
+import glob
+import time
+import threading
+import numpy as np
+import pandas as pd
+from loguru import logger
+from price_validate import normalize_detail
+import metrics
+
+'''
+Локальный индекс деталей: нормализованные (Brand, DetailNum) -> PartID.
+
+Индекс - два отсортированных по ключу массива numpy (хэш ключа uint64 и PartID int64)
+в файлах .npy, которые открываются через memory map: процессы разбора читают один
+и тот же файл без копирования в память. В meta.json - версия файлов, отметка
+(наибольший PartID), до которой детали уже загружены, и время полной сборки.
+
+Первый refresh загружает все детали одним запросом, следующие - только детали
+с PartID больше отметки за вычетом окна window: значения identity выделяются
+до фиксации транзакции, поэтому деталь с меньшим PartID может появиться позже
+детали с большим. Запрос читает только зафиксированные строки (без NOLOCK):
+откаченные детали в индекс не попадают. Раз в rebuild_seconds индекс собирается
+заново целиком - так из него уходят удалённые и объединённые детали.
+Запрос задаётся в settings.ini ([parts] query) и получает нижнюю границу PartID
+параметром; он должен вернуть PartID, Brand, DetailNum по возрастанию PartID.
+
+fill заполняет PartID части прайса векторно (searchsorted по хэшам); для деталей,
+которых нет в индексе, PartID остаётся пустым и определяется в PriceUpdate.
+Ключи сравниваются по 64-битному хэшу, совпадение хэшей разных ключей не проверяется.
+'''
+
+QUERY = """
+SELECT p.PartID, p.Brand, p.DetailNum
+  FROM tParts p
+ WHERE p.PartID > ?
+ ORDER BY p.PartID
+"""
+
+# Сколько строк запроса читается за один fetchmany
+FETCH_ROWS = 500000
+
+# Сколько PartID ниже отметки перечитывается при догрузке (детали из ещё не зафиксированных транзакций)
+WINDOW = 100000
+
+# Период полной сборки индекса, секунд
+REBUILD_SECONDS = 24 * 3600
+
+
+def part_keys(brand, detail):
+    """part_keys - хэши нормализованных ключей (бренд без пробелов по краям в верхнем регистре, номер - см. normalize_detail)"""
+    brand = pd.Series(brand, dtype=object).astype(str).str.strip().str.upper()
+    detail = normalize_detail(pd.Series(detail, dtype=object).astype(str))
+    return pd.util.hash_pandas_object(pd.DataFrame({"Brand": brand.to_numpy(), "DetailNum": detail.to_numpy()}),
+                                      index=False).to_numpy()
+
+
+class PartIndex:
+    """PartIndex - индекс деталей в каталоге path"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta = {"version": 0, "hwm": 0, "count": 0, "built": 0}
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._parts = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _file(self, name, version):
+        return os.path.join(self.path, f"{name}_{version}.npy")
+
+    def load(self):
+        """load - открыть файлы индекса, если с прошлого открытия вышла новая версия"""
+        meta_path = os.path.join(self.path, "meta.json")
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            if meta["version"] == self.meta["version"] and len(self._keys) == meta["count"]:
+                return False
+            if meta["count"]:
+                self._keys = np.load(self._file("keys", meta["version"]), mmap_mode="r")
+                self._parts = np.load(self._file("parts", meta["version"]), mmap_mode="r")
+            else:
+                self._keys = np.empty(0, dtype=np.uint64)
+                self._parts = np.empty(0, dtype=np.int64)
+            self.meta = meta
+        return True
+
+    def refresh(self, db, query=QUERY, window=WINDOW, rebuild_seconds=REBUILD_SECONDS):
+        """refresh - догрузить детали с PartID больше отметки минус window
+
+        При первом вызове и раз в rebuild_seconds индекс собирается заново из всех деталей.
+        db - Sql или SqlPool. Возвращает число прочитанных деталей. Запрос только читает,
+        поэтому вызов можно повторить при временной ошибке (connect.retry).
+        """
+        full = not self.meta["hwm"] or time.time() - self.meta.get("built", 0) >= rebuild_seconds
+        since = 0 if full else max(self.meta["hwm"] - window, 0)
+        with metrics.span("parts_refresh", full=full) as s:
+            ids, keys = self._fetch(db, query, since)
+            s.add(rows=len(ids))
+        if not len(ids) and not full:
+            return 0
+
+        if full:
+            keys_all, parts_all = keys, ids
+        else:
+            with self._lock:
+                keys_all = np.concatenate([np.asarray(self._keys), keys])
+                parts_all = np.concatenate([np.asarray(self._parts), ids])
+        # при повторе ключа действует деталь с большим PartID: сортировка по ключу, затем по PartID
+        order = np.lexsort((parts_all, keys_all))
+        keys_all, parts_all = keys_all[order], parts_all[order]
+        last = np.ones(len(keys_all), dtype=bool)
+        last[:-1] = keys_all[1:] != keys_all[:-1]
+        keys_all, parts_all = keys_all[last], parts_all[last]
+
+        version = self.meta["version"] + 1
+        np.save(self._file("keys", version), keys_all)
+        np.save(self._file("parts", version), parts_all)
+        meta = {
+            "version": version,
+            "hwm": max(int(ids.max()) if len(ids) else 0, 0 if full else self.meta["hwm"]),
+            "count": len(keys_all),
+            "built": time.time() if full else self.meta.get("built", 0),
+        }
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+        self.load()
+        self._cleanup(version)
+        logger.info(f"Индекс деталей{' собран заново' if full else ''}: прочитано {len(ids)}, "
+                    f"всего ключей {meta['count']}, отметка PartID {meta['hwm']}")
+        return len(ids)
+
+    def _fetch(self, db, query, hwm):
+        ids, keys = [], []
+        with db.connection_scope() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(query, hwm)
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                part_id, brand, detail = zip(*rows)
+                ids.append(np.asarray(part_id, dtype=np.int64))
+                keys.append(part_keys(brand, detail))
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+        return np.concatenate(ids), np.concatenate(keys)
+
+    def _cleanup(self, version):
+        # файлы прошлых версий; открытый другим процессом файл в Windows не удаляется - удалим в следующий раз
+        for path in glob.glob(os.path.join(self.path, "*_*.npy")):
+            if not path.endswith(f"_{version}.npy"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def fill(self, df):
+        """fill - df с заполненным по Brand и DetailNum столбцом PartID (Int64, пусто - деталь не найдена)"""
+        with self._lock:
+            keys_index, parts_index = self._keys, self._parts
+        part_id = np.full(len(df), np.nan)
+        if len(keys_index) and len(df):
+            keys = part_keys(df["Brand"].to_numpy(dtype=object), df["DetailNum"].to_numpy(dtype=object))
+            pos = np.searchsorted(keys_index, keys)
+            pos[pos >= len(keys_index)] = 0
+            found = keys_index[pos] == keys
+            part_id[found] = parts_index[pos[found]]
+        if "PartID" in df.columns:
+            # уже заданный в файле PartID не заменяется
+            given = pd.to_numeric(df["PartID"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            part_id = np.where(np.isnan(given), part_id, given)
+        return df.assign(PartID=pd.array(part_id, dtype="Int64"))
+
+
+# Индексы, уже открытые в этом процессе (разбор может идти в пуле процессов)
+_indexes = {}
+
+
+def get_index(path):
+    """get_index - индекс path, общий для процесса; открывает новую версию, если она вышла"""
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes[path] = PartIndex(path)
+    else:
+        index.load()
+    return index
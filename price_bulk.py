@@ -0,0 +1,224 @@
+import os
+import uuid
+import queue
+import shutil
+import subprocess
+import threading
+import contextvars
+from loguru import logger
+from _utils import t
+import bcp_native
+import metrics
+
+'''
+Загрузка в pPrice через BULK INSERT без промежуточного файла на весь прайс.
+
+По умолчанию части пишутся в двоичном формате SQL Server (bcp_native) с файлом
+формата; текстовый формат с табуляцией остаётся доступен (native=False).
+
+Строки пишутся в файлы-части в уникальном для запуска каталоге по мере разбора.
+Заполненная часть сразу отдаётся отдельному потоку, который выполняет для неё
+BULK INSERT (каждая часть фиксируется отдельно) и удаляет её, пока основной поток
+пишет следующую. Каталог должен быть доступен SQL Server по тому же пути.
+BcpSink загружает те же части утилитой bcp с клиента, без общего каталога.
+'''
+
+# Порядок столбцов pPrice для BULK INSERT
+COLUMN_ORDER = [
+    "Brand", "DetailNum", "DetailPrice", "DetailName", "PriceLogo",
+    "Quantity", "PackQuantity", "Reliability", "WeightKG", "VolumeKG",
+    "MOSA", "Restrictions", "PartID"
+]
+
+# Типы столбцов pPrice для двоичного формата (см. bcp_native)
+COLUMN_KINDS = {
+    "Brand": "str", "DetailNum": "str", "DetailPrice": "float", "DetailName": "str",
+    "PriceLogo": "str", "Quantity": "float", "PackQuantity": "float", "Reliability": "float",
+    "WeightKG": "float", "VolumeKG": "float", "MOSA": "float", "Restrictions": "str", "PartID": "int"
+}
+
+# Строк в одной части (один BULK INSERT)
+PART_ROWS = 500000
+
+
+def bulk_frame(data):
+    """bulk_frame - столбцы в порядке COLUMN_ORDER, недостающие заполняются пустыми значениями"""
+    missing = [col for col in COLUMN_ORDER if col not in data.columns]
+    if missing:
+        data = data.assign(**{col: None for col in missing})
+    return data[COLUMN_ORDER]
+
+
+class BulkSpoolSink:
+    """BulkSpoolSink - потоковая загрузка частями через BULK INSERT
+
+    with BulkSpoolSink(cnxn, spool_dir) as sink:
+        for df in chunks:
+            sink.write(df)
+    """
+    target_db = True
+
+    def __init__(self, cnxn, spool_dir, table="dbo.pPrice", part_rows=PART_ROWS, native=True):
+        self.table = table
+        self.clear_sql = f"TRUNCATE TABLE {table}"
+        self.part_rows = part_rows
+        self.native = native
+        self.run_dir = os.path.join(spool_dir, f"load_prices_{os.getpid()}_{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.run_dir, exist_ok=True)
+        if native:
+            self.format_path = os.path.join(self.run_dir, "pPrice.fmt")
+            with open(self.format_path, "w", encoding="ascii", newline="\r\n") as f:
+                f.write(bcp_native.format_file(COLUMN_ORDER, COLUMN_KINDS))
+        self.cursor = cnxn.cursor()
+        self.total = 0
+        self._file = None
+        self._path = None
+        self._rows = 0
+        self._parts = 0
+        self._error = None
+        # не больше одной готовой части в ожидании загрузки
+        self._queue = queue.Queue(maxsize=1)
+        # поток получает текущий контекст, чтобы его интервалы метрик были вложены в интервал загрузки
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._bulk_worker,), name="bulk", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(flush=exc_type is None)
+        return False
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, df):
+        """write - дописать строки в текущую часть, заполненная часть уходит на загрузку"""
+        self._check()
+        if self._file is None:
+            self._parts += 1
+            if self.native:
+                self._path = os.path.join(self.run_dir, f"part_{self._parts:05d}.dat")
+                self._file = open(self._path, "wb")
+            else:
+                self._path = os.path.join(self.run_dir, f"part_{self._parts:05d}.csv")
+                self._file = open(self._path, "w", encoding="utf-8", newline="")
+        if self.native:
+            bcp_native.write_native(df, self._file, COLUMN_ORDER, COLUMN_KINDS)
+        else:
+            bulk_frame(df).to_csv(self._file, sep='\t', index=False, header=False, lineterminator='\n')
+        self._rows += len(df)
+        if self._rows >= self.part_rows:
+            self._flush()
+
+    def _flush(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._rows:
+            self._put((self._path, self._rows))
+        else:
+            os.remove(self._path)
+        self._rows = 0
+
+    def _put(self, item):
+        while True:
+            self._check()
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if not self._thread.is_alive():
+                    self._check()
+                    raise RuntimeError("Поток BULK INSERT завершился")
+
+    def _bulk_worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            path, rows = item
+            try:
+                with metrics.span("insert", table=self.table) as s:
+                    s.add(rows=rows, bytes=os.path.getsize(path))
+                    self.load_part(path)
+                self.total += rows
+                logger.info(f"Загружена часть {os.path.basename(path)}: {rows} строк, всего {self.total}. Время выполнения: {t(s.duration)}")
+            except Exception as err:
+                self._error = err
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def load_part(self, path):
+        """load_part - загрузка одной части в table (BULK INSERT на стороне сервера)"""
+        if self.native:
+            bulk_query = f"""
+                BULK INSERT {self.table}
+                FROM '{path}'
+                WITH (
+                    FORMATFILE = '{self.format_path}',
+                    CODEPAGE = '65001',
+                    TABLOCK
+                )
+            """
+        else:
+            bulk_query = f"""
+                BULK INSERT {self.table}
+                FROM '{path}'
+                WITH (
+                    FIELDTERMINATOR = '\t',
+                    ROWTERMINATOR = '\n',
+                    CODEPAGE = '65001',
+                    TABLOCK
+                )
+            """
+        self.cursor.execute(bulk_query)
+
+    def close(self, flush=True):
+        """close - загрузить последнюю часть, дождаться загрузчика и удалить каталог запуска"""
+        try:
+            if flush:
+                self._flush()
+            elif self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        if flush:
+            self._check()
+
+
+class BcpSink(BulkSpoolSink):
+    """BcpSink - те же части, что у BulkSpoolSink, загружает утилита bcp на стороне клиента
+
+    Каталог частей не обязан быть доступен SQL Server, поэтому подходит локальный
+    временный каталог. Нужна утилита bcp (mssql-tools) в PATH.
+    Пароль не передаётся в командной строке (её видят все пользователи машины):
+    bcp получает его в переменной окружения SQLCMDPASSWORD и на запрос пароля
+    через stdin. Без имени пользователя используется доверенное подключение (-T).
+    """
+
+    def __init__(self, cnxn, spool_dir, server, database, username=None, password=None, **kwargs):
+        self.login = ["-S", server, "-d", database] + (["-U", username] if username else ["-T"])
+        self.env = dict(os.environ, SQLCMDPASSWORD=password) if username and password else None
+        self.password = password if username else None
+        super().__init__(cnxn, spool_dir, **kwargs)
+
+    def load_part(self, path):
+        """load_part - загрузка одной части командой bcp ... in"""
+        cmd = ["bcp", self.table, "in", path, *self.login, "-h", "TABLOCK", "-C", "65001"]
+        if self.native:
+            cmd += ["-f", self.format_path]
+        else:
+            cmd += ["-c", "-t", "\t", "-r", "\n"]
+        result = subprocess.run(cmd, capture_output=True, text=True, env=self.env,
+                                input=self.password + "\n" if self.password else None)
+        if result.returncode != 0:
+            raise RuntimeError(f"bcp завершилась с кодом {result.returncode}: {(result.stdout + result.stderr).strip()[-1000:]}")
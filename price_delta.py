@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+'''
+Инкрементальная загрузка прайсов.
+
+Для каждого файла профиля хранится снимок его последней успешной загрузки: ключ строки
+(Brand, DetailNum, PriceLogo), хэш ключа и хэш всей строки (parquet в кэше).
+При следующей загрузке на сервер уходят только новые (I), изменённые (U)
+и исчезнувшие (D) строки - в таблицу DELTA_TABLE, откуда их применяет DELTA_PROC.
+
+Удалёнными считаются только строки тех PriceLogo, что встретились в новом файле:
+несколько файлов одного профиля с разными прайсами не удаляют строки друг друга.
+Полная загрузка файла без инкрементального режима удаляет снимки профиля,
+следующая инкрементальная загрузка начинается с полной.
+'''
+
+KEY_COLUMNS = ["Brand", "DetailNum", "PriceLogo"]
+
+# Промежуточная таблица изменений: столбцы pPrice + Op ('I', 'U', 'D')
+DELTA_TABLE = "pPriceDelta"
+# Процедура, применяющая изменения из DELTA_TABLE (аналог PriceUpdate для дельты)
+DELTA_PROC = "PriceUpdateDelta"
+
+
+def key_hash(df):
+    return pd.util.hash_pandas_object(df[KEY_COLUMNS], index=False).to_numpy()
+
+
+def _wide(s):
+    if pd.api.types.is_integer_dtype(s.dtype):
+        return s.astype(np.float64)
+    if s.dtype == np.float32:
+        # через кратчайшую десятичную запись: 0.1 в float32 даёт 0.1, а не 0.10000000149
+        return pd.to_numeric(s.astype(str), errors="coerce")
+    return None
+
+
+def row_hash(df):
+    # целые и float32 столбцы (см. price_reader.compact_column) хэшируются как float64, как до сжатия,
+    # чтобы снимки прошлых загрузок оставались сравнимыми
+    wide = {col: _wide(df[col]) for col in df.columns}
+    wide = {col: s for col, s in wide.items() if s is not None}
+    return pd.util.hash_pandas_object(df.assign(**wide) if wide else df, index=False).to_numpy()
+
+
+class PriceSnapshot:
+    """PriceSnapshot - снимок загруженных строк профиля и вычисление изменений по нему"""
+
+    def __init__(self, path):
+        self.path = path
+        self.exists = os.path.exists(path)
+        self._parts = []
+        self._seen = np.empty(0, dtype=np.uint64)
+        self._logos = set()
+        if self.exists:
+            old = pd.read_parquet(path)
+            order = np.argsort(old["KeyHash"].to_numpy(), kind="stable")
+            self.old = old.iloc[order].reset_index(drop=True)
+            self._keys = self.old["KeyHash"].to_numpy()
+            self._rows = self.old["RowHash"].to_numpy()
+        else:
+            self.old = None
+
+    @staticmethod
+    def supports(columns):
+        """supports - есть ли в наборе полей всё, что нужно для ключа строки"""
+        return all(col in columns for col in KEY_COLUMNS)
+
+    def diff(self, df):
+        """diff - изменения части файла относительно снимка
+
+        Возвращает строки df с добавленным столбцом Op ('I' - новая, 'U' - изменённая).
+        Повторы ключа (в том числе из предыдущих частей) пропускаются: учитывается первая строка.
+        При проверке строк (price_validate) повторов в файле уже нет: из них оставлена
+        лучшая по правилу keep во всём файле.
+        """
+        keys = key_hash(df)
+        first = ~pd.Series(keys).duplicated().to_numpy() & ~np.isin(keys, self._seen)
+        df, keys = df[first], keys[first]
+        rows = row_hash(df)
+
+        self._seen = np.concatenate([self._seen, keys])
+        self._logos.update(df["PriceLogo"].dropna().unique())
+        part = df[KEY_COLUMNS].copy()
+        part["KeyHash"] = keys
+        part["RowHash"] = rows
+        self._parts.append(part)
+
+        if self.old is None:
+            op = np.full(len(df), "I", dtype=object)
+        else:
+            pos = np.searchsorted(self._keys, keys)
+            pos[pos >= len(self._keys)] = 0
+            found = self._keys[pos] == keys if len(self._keys) else np.zeros(len(keys), dtype=bool)
+            changed = found & (self._rows[pos] != rows)
+            op = np.where(found, np.where(changed, "U", ""), "I").astype(object)
+
+        out = df.assign(Op=op)
+        return out[out["Op"] != ""]
+
+    def deleted(self):
+        """deleted - ключи строк, которых больше нет в файле (Op = 'D')"""
+        if self.old is None:
+            return pd.DataFrame(columns=KEY_COLUMNS + ["Op"])
+        gone = self.old["PriceLogo"].isin(self._logos).to_numpy() & ~np.isin(self._keys, self._seen)
+        return self.old.loc[gone, KEY_COLUMNS].assign(Op="D")
+
+    def save(self):
+        """save - записать новый снимок (вызывать после успешного применения изменений)"""
+        parts = self._parts
+        if self.old is not None:
+            # строки прайсов, которых не было в этом файле, остаются как были
+            parts = [self.old[~self.old["PriceLogo"].isin(self._logos)]] + parts
+        parts = [p for p in parts if len(p)]
+        snapshot = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=KEY_COLUMNS + ["KeyHash", "RowHash"])
+        tmp = self.path + ".tmp"
+        snapshot.to_parquet(tmp, index=False)
+        os.replace(tmp, self.path)
+        logger.info(f"Снимок для инкрементальной загрузки сохранён: {self.path}, строк: {len(snapshot)}")
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from loguru import logger
+
+'''
+Подготовка строк DataFrame к передаче в pyodbc (executemany).
+
+Вместо проверки pd.isna для каждой ячейки столбцы приводятся к нужному типу
+целиком, пропуски заменяются на None по маске столбца, а строки собираются
+через zip по готовым столбцам.
+'''
+
+# Размер пакета для executemany по умолчанию
+BATCH_SIZE = 100000
+
+# Подбор размера пакета (BatchSizer): бюджет памяти на пакет, целевая длительность
+# одного executemany и пределы размера пакета
+BATCH_BYTES = 64 * 1024 * 1024
+BATCH_SECONDS = 2.0
+MIN_BATCH = 1000
+MAX_BATCH = 500000
+
+# Оценка памяти на одно значение: индикатор длины в буфере fast_executemany
+# и Python-объект в кортеже строки
+_PARAM_OVERHEAD = 8 + 40
+
+
+def field_kind(ftype):
+    """field_kind - класс типа по tFields.DataType: 'str', 'float', 'int' или None (без приведения)"""
+    ftype = (ftype or "").lower()
+    if "char" in ftype or "text" in ftype or ftype == "str":
+        return "str"
+    elif "float" in ftype or "real" in ftype or "decimal" in ftype or "numeric" in ftype or "money" in ftype:
+        return "float"
+    elif "int" in ftype:
+        return "int"
+    return None
+
+
+def field_kinds(field_map):
+    """field_kinds - классы типов для полей маппинга {FieldBrief: 'str' | 'float' | 'int' | None}"""
+    return {field: field_kind(meta["FieldDataType"]) for field, meta in field_map.items()}
+
+
+def encode_column(s, kind=None):
+    """encode_column - столбец в массив object с Python-значениями и None вместо пропусков"""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # значения категорий кодируются один раз и раздаются по кодам (код -1 - пропуск)
+        values = encode_column(pd.Series(s.cat.categories, dtype=object), kind)
+        return np.append(values, None)[s.cat.codes.to_numpy()]
+    if kind in ("float", "int"):
+        if not pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+            s = pd.to_numeric(s, errors="coerce")
+        # int-поля передаём как float: в файлах встречаются дробные количества,
+        # сервер приводит значение к типу столбца сам
+        values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        mask = np.isnan(values)
+        out = values.astype(object)
+    else:
+        mask = s.isna().to_numpy()
+        if kind == "str" and pd.api.types.infer_dtype(s, skipna=True) not in ("string", "empty"):
+            s = s.astype(str)
+        # копия, чтобы не испортить исходный DataFrame при замене пропусков
+        out = s.to_numpy(dtype=object, copy=True)
+    if mask.any():
+        out[mask] = None
+    return out
+
+
+def encode_rows(df, kinds=None):
+    """encode_rows - строки DataFrame в виде списка кортежей для executemany"""
+    kinds = kinds or {}
+    columns = [encode_column(df[col], kinds.get(col)) for col in df.columns]
+    return list(zip(*columns))
+
+
+def iter_batches(df, batchsize=BATCH_SIZE, kinds=None):
+    """iter_batches - пакеты строк для executemany, каждый пакет кодируется отдельно"""
+    for i in range(0, len(df), batchsize):
+        yield encode_rows(df.iloc[i:i+batchsize], kinds)
+
+
+def row_bytes(df, kinds=None):
+    """row_bytes - оценка памяти на одну строку пакета executemany, байт
+
+    fast_executemany держит буфер на весь пакет: числа по 8 байт, строки - по самой
+    длинной строке столбца в UTF-16. Сюда же добавляются Python-объекты кортежей строк.
+    """
+    kinds = kinds or {}
+    total = 56 + 8 * len(df.columns)
+    for col in df.columns:
+        kind = kinds.get(col)
+        s = df[col]
+        if kind in ("float", "int") or (kind is None and pd.api.types.is_numeric_dtype(s.dtype)):
+            total += 8 + _PARAM_OVERHEAD
+        else:
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                s = pd.Series(s.cat.categories, dtype=object)
+            longest = s.astype(str).str.len().max() if len(s) else 0
+            total += 2 * (int(longest or 0) + 1) + _PARAM_OVERHEAD + int(longest or 0)
+    return total
+
+
+class BatchSizer:
+    """BatchSizer - размер пакета executemany по бюджету памяти и времени выполнения пакетов
+
+    Размер пакета не больше target_bytes / row_bytes строк. После каждого пакета (observe)
+    размер меняется так, чтобы один executemany длился около target_seconds:
+    растёт не больше чем вдвое за раз, уменьшается сразу. Один объект используется
+    для всех частей и файлов, так что подобранный размер сохраняется между ними.
+    """
+
+    def __init__(self, target_bytes=BATCH_BYTES, target_seconds=BATCH_SECONDS,
+                 min_rows=MIN_BATCH, max_rows=MAX_BATCH, rows=10000):
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.rows = rows
+        self.row_bytes = None
+        self.rate = None
+
+    def _clamp(self, rows):
+        if self.row_bytes:
+            rows = min(rows, self.target_bytes // self.row_bytes)
+        return int(max(self.min_rows, min(self.max_rows, rows)))
+
+    def size(self, df=None, kinds=None):
+        """size - размер следующего пакета (df - строки, по которым оценивается ширина строки)"""
+        if df is not None and len(df):
+            self.row_bytes = row_bytes(df, kinds)
+        self.rows = self._clamp(self.rows)
+        return self.rows
+
+    def observe(self, rows, seconds):
+        """observe - учесть время выполнения пакета из rows строк"""
+        if rows <= 0 or seconds <= 0:
+            return
+        self.rate = rows / seconds
+        # неполный последний пакет не повод уменьшать размер
+        if rows < self.rows and seconds < self.target_seconds:
+            return
+        rows = self._clamp(min(self.rows * 2, self.rate * self.target_seconds))
+        if rows != self.rows:
+            logger.debug(f"Размер пакета executemany: {self.rows} -> {rows} строк ({self.rate:,.0f} строк/с)")
+            self.rows = rows
+
+
+def iter_adaptive(df, sizer, kinds=None):
+    """iter_adaptive - пакеты строк для executemany размером sizer.size()
+
+    Размер берётся перед каждым пакетом, поэтому время выполнения предыдущего пакета,
+    переданное в sizer.observe, учитывается сразу.
+    """
+    sizer.size(df, kinds)
+    i = 0
+    while i < len(df):
+        batchsize = sizer.size()
+        yield encode_rows(df.iloc[i:i+batchsize], kinds)
+        i += batchsize
+
+
+def to_arrow(df):
+    """to_arrow - DataFrame в таблицу Arrow (без индекса)"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # Столбец со смесью чисел и строк (бывает в Excel) - приводим значения к строкам
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
@@ -0,0 +1,205 @@
+import uuid
+import queue
+import threading
+import contextvars
+import numpy as np
+import pandas as pd
+from loguru import logger
+from _utils import t
+import metrics
+import price_encoder
+from price_encoder import BatchSizer
+
+'''
+Параллельная загрузка файла в pPrice по нескольким подключениям.
+
+Строки каждой части делятся на partitions частей по хэшу номера детали. Каждую
+часть загружает свой поток через executemany по своему подключению из пула в свою
+промежуточную таблицу ##pPriceStage_<запуск>_<i>. Таблица глобальная временная:
+она живёт, пока открыто создавшее её подключение, и видна основному подключению,
+которое после загрузки всех частей одним запросом переносит строки в pPrice
+(INSERT ... SELECT ... UNION ALL). Промежуточные таблицы затем удаляются.
+'''
+
+# Число частей (потоков и подключений) по умолчанию
+PARTITIONS = 4
+
+# Сколько частей может ждать загрузки в одном потоке
+QUEUE_SIZE = 2
+
+# Столбец, по хэшу которого строки делятся на части
+PARTITION_KEY = "DetailNum"
+
+
+def partition(df, partitions):
+    """partition - разбиение строк на partitions частей по хэшу PARTITION_KEY (или номеру строки)"""
+    if PARTITION_KEY in df.columns:
+        h = pd.util.hash_pandas_object(df[PARTITION_KEY], index=False).to_numpy()
+    else:
+        h = np.arange(len(df), dtype=np.uint64)
+    h = h % np.uint64(partitions)
+    return [df[h == i] for i in range(partitions)]
+
+
+class ParallelSink:
+    """ParallelSink - загрузка строк в table по partitions подключениям через промежуточные таблицы
+
+    with ParallelSink(pool, cursor, partitions) as sink:
+        for df in chunks:
+            sink.write(df)
+
+    cursor - курсор основного подключения: им выполняется перенос в table при закрытии.
+    В пуле должно быть не меньше partitions свободных подключений помимо основного.
+    """
+    target_db = True
+
+    def __init__(self, pool, cursor, partitions=PARTITIONS, kinds=None, table="pPrice"):
+        self.clear_sql = f"DELETE FROM {table}"
+        self.pool = pool
+        self.cursor = cursor
+        self.partitions = partitions
+        self.kinds = kinds
+        self.table = table
+        self.run_id = uuid.uuid4().hex[:8]
+        self.total = 0
+        self.columns = None
+        self._error = None
+        self._rows = [0] * partitions
+        self._created = [False] * partitions
+        self._queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(partitions)]
+        self._loaded = [threading.Event() for _ in range(partitions)]
+        # подключения держим, пока строки не перенесены из промежуточных таблиц
+        self._merged = threading.Event()
+        self._threads = [
+            # у каждого потока своя копия контекста: интервалы метрик вкладываются в интервал загрузки файла
+            threading.Thread(target=contextvars.copy_context().run, args=(self._worker, i),
+                             name=f"partition-{i}", daemon=True)
+            for i in range(partitions)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(flush=exc_type is None)
+        return False
+
+    def stage_table(self, i):
+        return f"##pPriceStage_{self.run_id}_{i}"
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _put(self, i, item):
+        while True:
+            self._check()
+            try:
+                self._queues[i].put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if not self._threads[i].is_alive():
+                    self._check()
+                    raise RuntimeError(f"Поток загрузки части {i} завершился")
+
+    def write(self, df):
+        """write - разделить строки по частям и передать потокам загрузки"""
+        self._check()
+        if not len(df):
+            return
+        if self.columns is None:
+            self.columns = list(df.columns)
+        for i, part in enumerate(partition(df, self.partitions)):
+            if len(part):
+                self._put(i, part)
+        self.total += len(df)
+
+    def _load_part(self, cursor, i, df, sizer):
+        if not self._created[i]:
+            cols = ", ".join(self.columns)
+            cursor.execute(f"SELECT TOP 0 {cols} INTO {self.stage_table(i)} FROM {self.table}")
+            self._created[i] = True
+        placeholders = ", ".join(["?"] * len(self.columns))
+        insert_sql = f"INSERT INTO {self.stage_table(i)} ({', '.join(self.columns)}) VALUES ({placeholders})"
+        for batch in price_encoder.iter_adaptive(df[self.columns], sizer, self.kinds):
+            with metrics.span("insert", table=self.stage_table(i)) as s:
+                cursor.executemany(insert_sql, batch)
+                s.add(rows=len(batch))
+            sizer.observe(len(batch), s.duration)
+        self._rows[i] += len(df)
+
+    def _worker(self, i):
+        try:
+            cnxn = self.pool.checkout()
+        except Exception as err:
+            self._error = err
+            self._loaded[i].set()
+            return
+        broken = False
+        try:
+            cursor = cnxn.cursor()
+            cursor.fast_executemany = True
+            sizer = BatchSizer()
+            while True:
+                df = self._queues[i].get()
+                if df is None:
+                    break
+                if self._error is not None:
+                    continue
+                try:
+                    self._load_part(cursor, i, df, sizer)
+                except Exception as err:
+                    self._error = err
+            self._loaded[i].set()
+            self._merged.wait()
+            if self._created[i]:
+                cursor.execute(f"DROP TABLE {self.stage_table(i)}")
+        except Exception as err:
+            broken = True
+            if self._error is None and not self._merged.is_set():
+                self._error = err
+            logger.warning(f"Ошибка потока загрузки части {i} ({self.stage_table(i)}): {err}")
+        finally:
+            self._loaded[i].set()
+            self.pool.checkin(cnxn, broken)
+
+    def _put_end(self, i):
+        # Маркер конца строк; после ошибки поток продолжает разбирать очередь, так что место освободится
+        while self._threads[i].is_alive():
+            try:
+                self._queues[i].put(None, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def merge(self):
+        """merge - перенос строк из всех промежуточных таблиц в table одним запросом"""
+        stages = [self.stage_table(i) for i in range(self.partitions) if self._created[i]]
+        if not stages:
+            return 0
+        cols = ", ".join(self.columns)
+        select = "\nUNION ALL\n".join(f"SELECT {cols} FROM {stage}" for stage in stages)
+        with metrics.span("merge", table=self.table) as s:
+            self.cursor.execute(f"INSERT INTO {self.table} WITH (TABLOCK) ({cols})\n{select}")
+            s.add(rows=sum(self._rows))
+        logger.info(f"Строки из {len(stages)} промежуточных таблиц перенесены в {self.table}: {sum(self._rows)}. "
+                    f"Время выполнения: {t(s.duration)}")
+        return sum(self._rows)
+
+    def close(self, flush=True):
+        """close - дождаться загрузки всех частей, перенести строки в table (flush) и освободить подключения"""
+        try:
+            for i in range(self.partitions):
+                self._put_end(i)
+            for i in range(self.partitions):
+                while not self._loaded[i].wait(0.5) and self._threads[i].is_alive():
+                    continue
+            if flush:
+                self._check()
+                self.merge()
+        finally:
+            self._merged.set()
+            for thread in self._threads:
+                thread.join()
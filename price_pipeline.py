@@ -0,0 +1,210 @@
+import os
+import queue
+import uuid
+import shutil
+import tempfile
+import threading
+import time
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import pyarrow as pa
+from loguru import logger
+from _utils import timing_decorator
+from connect import retry, is_transient, RETRY_ATTEMPTS, RETRY_DELAY
+import price_reader
+import price_encoder
+import metrics
+
+# Сколько готовых частей одного файла может ждать загрузки
+QUEUE_SIZE = 4
+
+# Маркер конца файла в очереди частей
+_DONE = object()
+
+
+def spool_file(job, chunksize, spool_dir, cache=None):
+    """spool_file - разбор файла в процессе-обработчике
+
+    Готовые части пишутся в spool_dir файлами Arrow IPC (по файлу на часть, у частей
+    может различаться схема), в основной процесс возвращается только список путей.
+    DataFrame через pickle не передаются. Имена частей уникальны для задания: один файл
+    может входить в несколько профилей, а одноимённые файлы - лежать в разных каталогах.
+    """
+    base = os.path.join(spool_dir, f"{os.getpid()}_{uuid.uuid4().hex}_{os.path.basename(job['file_path'])}")
+    parts = []
+    for i, df_ready in enumerate(price_reader.parse_file(job, chunksize, cache)):
+        path = f"{base}.{i}.arrow"
+        table = price_encoder.to_arrow(df_ready)
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        parts.append(path)
+    return parts
+
+
+def read_spool(parts):
+    """read_spool - чтение частей, подготовленных spool_file, с удалением прочитанных"""
+    try:
+        for path in parts:
+            with pa.memory_map(path) as source:
+                df_ready = pa.ipc.open_file(source).read_all().to_pandas()
+            os.remove(path)
+            yield df_ready
+    finally:
+        for path in parts:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class PricePipeline:
+    """PricePipeline - конвейер: разбор следующих файлов идёт одновременно с загрузкой текущего
+
+    Потоки-парсеры читают и маппят файлы, складывая готовые части в ограниченные очереди
+    (по одной на файл). Единственный загрузчик (поток, вызвавший run) забирает файлы строго
+    в порядке заданий: pPrice - общая промежуточная таблица, поэтому очистка, вставка
+    и PriceUpdate одного файла не должны пересекаться с другим.
+    Память ограничена: не более workers файлов в разборе и queue_size частей на файл.
+
+    При processes = True файлы разбираются в пуле процессов (spool_file), результат
+    возвращается файлами Arrow IPC. Загрузка остаётся на подключении основного процесса.
+    При временной ошибке базы файл загружается заново с повтором (connect.retry), как
+    в последовательном режиме.
+    """
+
+    def __init__(self, loader, workers=1, queue_size=QUEUE_SIZE, processes=False):
+        self.loader = loader
+        self.processes = processes
+        if processes and not workers:
+            workers = os.cpu_count() or 1
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+
+    def _put(self, q, item, cancel):
+        # Ожидаем место в очереди, пока ожидание не отменено
+        while not cancel.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _parse(self, job, chunks, cancel):
+        try:
+            for df_ready in self.loader.parse_file(job):
+                if not self._put(chunks, df_ready, cancel):
+                    return
+            self._put(chunks, _DONE, cancel)
+        except Exception as ex:
+            self._put(chunks, ex, cancel)
+
+    def _drain(self, chunks):
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _submit(self, executor, job, spool_dir):
+        # Возвращает источник частей для загрузчика и событие отмены разбора
+        cancel = threading.Event()
+        if self.processes:
+            return executor.submit(spool_file, job, self.loader.chunksize, spool_dir, self.loader.parse_cache), cancel
+        chunks = queue.Queue(maxsize=self.queue_size)
+        executor.submit(self._parse, job, chunks, cancel)
+        return chunks, cancel
+
+    def _chunks(self, source):
+        if self.processes:
+            return read_spool(source.result())
+        return self._drain(source)
+
+    def _discard(self, source, cancel):
+        cancel.set()
+        if self.processes and not source.cancel() and source.done() and source.exception() is None:
+            for path in source.result():
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @timing_decorator
+    def run(self, jobs):
+        if self.processes:
+            spool_dir = tempfile.mkdtemp(prefix="load_prices_")
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+            logger.info(f"Разбор файлов в {self.workers} процессах, промежуточные файлы: {spool_dir}")
+        else:
+            spool_dir = None
+            executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parser")
+        try:
+            self._run(jobs, executor, spool_dir)
+        finally:
+            if spool_dir:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
+    def _load(self, job, source, cancel):
+        file = os.path.basename(job["file_path"])
+        try:
+            with self.loader.file_span(job) as s:
+                logger.info(f"Загрузка файла: {job['file_path']}")
+                s.add(rows=self._load_chunks(job, source, cancel))
+                self.loader.file_done(job)
+            logger.success(f"Файл обработан: {file}")
+        except Exception as ex:
+            logger.error(f"Ошибка при обработке файла {file} профиля {job['profile_id']}: {ex}")
+        finally:
+            # Освобождаем парсер, если файл не дочитан из-за ошибки
+            self._discard(source, cancel)
+
+    def _load_chunks(self, job, source, cancel):
+        # при временной ошибке базы файл загружается заново, как retry(load_file) в последовательном режиме:
+        # части из очереди уже отданы, поэтому повтор разбирает файл в потоке загрузчика
+        try:
+            return self.loader.load_chunks(job, self._chunks(source))
+        except Exception as err:
+            if not is_transient(err):
+                raise
+            logger.warning(f"Временная ошибка базы данных при загрузке файла {os.path.basename(job['file_path'])}, "
+                           f"повтор загрузки: {err}")
+            self._discard(source, cancel)
+            time.sleep(RETRY_DELAY)
+            return retry(self.loader.load_file, job, attempts=RETRY_ATTEMPTS - 1)
+
+    def _run(self, jobs, executor, spool_dir):
+        # Очередь файлов ограничена числом парсеров: новые файлы не начинаем, пока загрузчик не догонит
+        files = queue.Queue(maxsize=self.workers)
+        stop = threading.Event()
+
+        def feed():
+            try:
+                for job in jobs:
+                    source, cancel = self._submit(executor, job, spool_dir)
+                    if not self._put(files, (job, source, cancel), stop):
+                        self._discard(source, cancel)
+                        break
+            except Exception as ex:
+                logger.error(f"Ошибка при получении списка файлов: {ex}")
+            finally:
+                self._put(files, None, stop)
+
+        with executor:
+            feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+            feeder.start()
+            try:
+                # файлы одного профиля идут подряд: группируем их в интервал метрик профиля
+                items = iter(files.get, None)
+                for profile_id, profile_items in groupby(items, key=lambda item: item[0]["profile_id"]):
+                    with metrics.span("profile", profile_id=profile_id):
+                        for job, source, cancel in profile_items:
+                            self._load(job, source, cancel)
+            finally:
+                stop.set()
+                feeder.join()
+                # Отменяем всё, что ещё ждёт в очереди, чтобы парсеры не зависли на put
+                while True:
+                    try:
+                        item = files.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        self._discard(item[1], item[2])
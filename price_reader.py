@@ -0,0 +1,337 @@
+import os
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+import openpyxl
+from loguru import logger
+from price_encoder import field_kind
+from parse_cache import cache_key
+from price_validate import PriceValidator
+import brand_index
+import parts_index
+import price_source
+import metrics
+
+'''
+Чтение и маппинг файлов прайсов без обращения к базе данных.
+Функции модуля можно вызывать в отдельных процессах: им нужны только задание
+(профиль, путь к файлу, маппинг полей) и размер части.
+'''
+
+# Размер части файла (строк) при потоковой загрузке, None - читать файл целиком
+CHUNK_SIZE = 200000
+
+# Форматы Excel, которые читаются потоково через openpyxl (остальные - через pd.read_excel)
+STREAM_EXCEL = (".xlsx", ".xlsm")
+
+# Строковый столбец хранится категориями, если различных значений не больше этой доли строк,
+# иначе - строками Arrow (string[pyarrow])
+CATEGORY_RATIO = 0.5
+
+
+def read_spec(field_map):
+    """read_spec - какие столбцы файла читать и с какими типами
+
+    Возвращает (usecols, dtypes): отсортированный список позиций (с 0) столбцов,
+    на которые ссылается маппинг, и словарь позиция -> тип по tFields.DataType.
+    Немаппленные столбцы не читаются, числовые поля сразу читаются как float64.
+    """
+    dtypes = {}
+    for field, meta in field_map.items():
+        if meta["MappingDataType"] != 0 or meta["DataValue"] is None:
+            continue
+        try:
+            idx = int(meta["DataValue"]) - 1
+        except (TypeError, ValueError):
+            logger.warning(f"Некорректный номер столбца {meta['DataValue']} для поля {field}")
+            continue
+        if idx < 0:
+            continue
+        kind = field_kind(meta["FieldDataType"])
+        # int-поля читаем как float: пропуски в int64 не помещаются
+        dtype = float if kind in ("float", "int") else str
+        # если один столбец маппится в поля разных типов - читаем как строку
+        dtypes[idx] = str if dtypes.get(idx, dtype) is str else dtype
+    return sorted(dtypes), dtypes
+
+
+def _apply_spec(df_raw, usecols):
+    # Столбцы называем позициями в файле: маппинг ссылается на номер столбца, а не на заголовок
+    df_raw.columns = usecols
+    return df_raw
+
+
+def _excel_types(df_raw, dtypes):
+    # read_excel понимает dtype только по именам уже отобранных столбцов, поэтому приводим после чтения
+    for idx, dtype in dtypes.items():
+        s = df_raw[idx]
+        if dtype is float:
+            df_raw[idx] = pd.to_numeric(s, errors="coerce")
+        else:
+            df_raw[idx] = s.where(s.isna(), s.astype(str))
+    return df_raw
+
+
+def _skip_rows(begin_row):
+    # BeginRow - номер строки (с 1), с которой начинается таблица (заголовок или данные)
+    return max(int(begin_row or 1), 1) - 1
+
+
+def read_excel_chunks(file_path, has_header, usecols, dtypes, chunksize=CHUNK_SIZE, begin_row=None):
+    """read_excel_chunks - потоковое чтение xlsx через openpyxl в режиме read_only
+
+    Книга не загружается в память целиком: строки первого листа читаются по одной,
+    из них берутся только столбцы usecols. Пустые строки пропускаются, как в pd.read_excel.
+    """
+    min_row = _skip_rows(begin_row) + (2 if has_header else 1)
+    pick = itemgetter(*usecols)
+    single = len(usecols) == 1
+
+    def frame(rows):
+        df_raw = pd.DataFrame.from_records(rows, columns=usecols)
+        return _excel_types(df_raw, dtypes)
+
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = []
+        for row in ws.iter_rows(min_row=min_row, max_col=usecols[-1] + 1, values_only=True):
+            values = (pick(row),) if single else pick(row)
+            if all(v is None for v in values):
+                continue
+            rows.append(values)
+            if chunksize and len(rows) >= chunksize:
+                yield frame(rows)
+                rows = []
+        if rows or not chunksize:
+            yield frame(rows)
+    finally:
+        wb.close()
+
+
+def read_chunks(file_path, file_type, delimiter, has_header, chunksize=CHUNK_SIZE, field_map=None, begin_row=None, member=None):
+    """read_chunks - чтение файла частями по chunksize строк
+
+    При chunksize = None файл читается целиком одним DataFrame.
+    Если передан field_map, читаются только маппленные столбцы (см. read_spec),
+    столбцы результата называются позициями в файле (с 0).
+    Excel (xlsx) с маппингом читается потоково (read_excel_chunks) с учётом BeginRow,
+    остальные форматы Excel читаются целиком и отдаются срезами.
+    Сжатые файлы (.gz, .zst) и файл member из zip распаковываются по мере чтения
+    (см. price_source), формат определяется по имени файла внутри архива.
+    """
+    if price_source.is_packed(file_path, member):
+        with price_source.open_source(file_path, member, seekable=file_type != 0) as source:
+            yield from _read_chunks(source, price_source.inner_name(file_path, member), file_type, delimiter,
+                                    has_header, chunksize, field_map, begin_row)
+    else:
+        yield from _read_chunks(file_path, file_path, file_type, delimiter, has_header, chunksize, field_map, begin_row)
+
+
+def _read_chunks(source, name, file_type, delimiter, has_header, chunksize, field_map, begin_row):
+    usecols, dtypes = read_spec(field_map) if field_map else (None, None)
+
+    if file_type != 0 and usecols and os.path.splitext(name)[1].lower() in STREAM_EXCEL:
+        yield from read_excel_chunks(source, has_header, usecols, dtypes, chunksize, begin_row)
+        return
+
+    if file_type == 0:
+        reader = pd.read_csv(
+            source,
+            delimiter=delimiter,
+            header=0 if has_header else None,
+            encoding="ansi",
+            low_memory=False,
+            usecols=usecols,
+            dtype=dtypes,
+            chunksize=chunksize
+        )
+        if chunksize is None:
+            yield reader if usecols is None else _apply_spec(reader, usecols)
+            return
+        with reader:
+            for df_raw in reader:
+                yield df_raw if usecols is None else _apply_spec(df_raw, usecols)
+    else:
+        df_raw = pd.read_excel(
+            source,
+            header=0 if has_header else None,
+            skiprows=_skip_rows(begin_row),
+            usecols=usecols,
+            # без object pandas превращает столбец номеров с пропусками в float ("001" -> 1.0)
+            dtype=None if usecols is None else object
+        )
+        if usecols is not None:
+            df_raw = _excel_types(_apply_spec(df_raw, usecols), dtypes)
+        if chunksize is None:
+            yield df_raw
+            return
+        for i in range(0, len(df_raw), chunksize):
+            yield df_raw.iloc[i:i+chunksize]
+
+
+def compact_column(s, ftype):
+    """compact_column - столбец в компактном представлении по tFields.DataType
+
+    Строки: категории для повторяющихся значений (бренд, прайс, ограничения),
+    иначе строки Arrow вместо Python-объектов. Целые - самый узкий целый тип,
+    если в части нет пропусков и дробных значений; real - float32.
+    Значения не меняются: кодирование для сервера (price_encoder, bcp_native) их восстанавливает.
+    """
+    kind = field_kind(ftype)
+    ftype = (ftype or "").lower()
+    if kind == "str":
+        if isinstance(s.dtype, pd.CategoricalDtype) or not len(s):
+            return s
+        if s.nunique(dropna=True) <= len(s) * CATEGORY_RATIO:
+            return s.astype("category")
+        return s.astype("string[pyarrow]")
+    if kind == "int":
+        s = pd.to_numeric(s, errors="coerce")
+        values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        if len(values) and not np.isnan(values).any() and (values == np.round(values)).all():
+            return pd.to_numeric(s, downcast="integer")
+        return s
+    if kind == "float" and "real" in ftype:
+        return pd.to_numeric(s, errors="coerce").astype(np.float32)
+    return s
+
+
+def constant_column(val, ftype, n):
+    """constant_column - столбец-константа (MappingDataType = 1): значение хранится один раз"""
+    kind = field_kind(ftype)
+    if kind in ("float", "int"):
+        number = pd.to_numeric(pd.Series([val]), errors="coerce").iloc[0]
+        return compact_column(pd.Series(np.full(n, number, dtype=np.float64)), ftype).to_numpy()
+    # категория с одним значением: на строку приходится один байт кода
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8) if val is not None else np.full(n, -1, dtype=np.int8),
+                                     categories=[val] if val is not None else [])
+
+
+def map_chunk(df_raw, field_map, file):
+    """map_chunk - преобразование прочитанных строк в набор столбцов pPrice по маппингу
+
+    Столбцы df_raw должны называться позициями в файле (с 0), как их отдаёт read_chunks.
+    Столбцы результата компактные (см. compact_column, constant_column).
+    """
+    # Индекс берём из df_raw, иначе при чтении частями столбцы-константы
+    # и столбцы из файла не совпадут по индексу
+    df_ready = pd.DataFrame(index=df_raw.index)
+
+    for field, meta in field_map.items():
+        dtype = meta["MappingDataType"]
+        val   = meta["DataValue"]
+
+        if dtype == 0:
+            try:
+                idx = int(val) - 1
+                if idx not in df_raw.columns:
+                    logger.error(f"Индекс {val} для поля '{field}' выходит за пределы столбцов")
+                    raise IndexError(f"Индекс {val} для '{field}' недопустим")
+                df_ready[field] = df_raw[idx]
+            except Exception as e:
+                logger.error(f"Ошибка чтения столбца {val} для поля {field} в файле {file}: {e}")
+                raise
+        elif dtype == 1:
+            df_ready[field] = constant_column(val, meta["FieldDataType"], len(df_raw))
+
+    if "DetailNum" in df_ready.columns:
+        df_ready = df_ready[df_ready["DetailNum"].notna() & (df_ready["DetailNum"] != "")]
+
+    # сжимаем после отбора строк: категории строятся только по оставшимся значениям
+    return compact_frame(df_ready, field_map)
+
+
+def compact_frame(df_ready, field_map):
+    """compact_frame - столбцы маппинга в компактном представлении (см. compact_column)"""
+    compact = {
+        field: compact_column(df_ready[field], meta["FieldDataType"])
+        for field, meta in field_map.items()
+        if field in df_ready.columns
+    }
+    return df_ready.assign(**compact)
+
+
+def parse_file(job, chunksize=CHUNK_SIZE, cache=None):
+    """parse_file - чтение и маппинг файла из задания, генератор готовых к загрузке частей
+
+    cache - ParseCache для Excel-профилей (FileTypeID != 0): при совпадении хэша файла
+    и маппинга разбор не выполняется, разобранные части пишутся в кэш по мере разбора.
+    Если в задании указан справочник брендов (job["brands"], см. brand_index), коды
+    брендов заменяются названиями, по индексу деталей (job["parts"], см. parts_index)
+    заполняется PartID. Если есть правила проверки (job["validate"],
+    см. price_validate), отдаются только прошедшие проверку строки.
+    В кэше хранится результат маппинга до этих шагов.
+    """
+    chunks = _map_file(job, chunksize, cache)
+    if job.get("brands"):
+        chunks = _resolve_brands(chunks, job["brands"], {"profile_id": job.get("profile_id"), "file": os.path.basename(job["file_path"])})
+    if job.get("parts"):
+        chunks = _fill_parts(chunks, job["parts"], {"profile_id": job.get("profile_id"), "file": os.path.basename(job["file_path"])})
+    if job.get("validate"):
+        validator = PriceValidator(job["validate"], job.get("rejects_path"), os.path.basename(job["file_path"]))
+        chunks = validator.chunks(chunks)
+    return chunks
+
+
+def _resolve_brands(chunks, path, attrs):
+    index = brand_index.get_index(path)
+    for df_ready in chunks:
+        if "Brand" in df_ready.columns:
+            with metrics.span("brands", **attrs) as s:
+                df_ready = df_ready.assign(Brand=index.lookup(df_ready["Brand"]))
+                s.add(rows=len(df_ready))
+        yield df_ready
+
+
+def _fill_parts(chunks, path, attrs):
+    index = parts_index.get_index(path)
+    for df_ready in chunks:
+        if "Brand" in df_ready.columns and "DetailNum" in df_ready.columns:
+            with metrics.span("parts", **attrs) as s:
+                df_ready = index.fill(df_ready)
+                s.add(rows=int(df_ready["PartID"].notna().sum()))
+        yield df_ready
+
+
+def _map_file(job, chunksize, cache):
+    file = os.path.basename(job["file_path"])
+
+    writer = None
+    if cache is not None and job["file_type"] != 0 and job.get("fingerprint"):
+        key = cache_key(job)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Файл {file} взят из кэша разобранных файлов")
+            for df_ready in cached:
+                # в кэше столбцы хранятся строками и float64, как до сжатия
+                yield compact_frame(df_ready, job["field_map"])
+            return
+        writer = cache.writer(key, job["field_map"])
+
+    completed = False
+    attrs = {"profile_id": job.get("profile_id"), "file": file}
+    try:
+        for df_raw in metrics.iter_spans("read", _read_job(job, chunksize), **attrs):
+            with metrics.span("map", **attrs) as s:
+                df_ready = map_chunk(df_raw, job["field_map"], file)
+                s.add(rows=len(df_ready))
+            if writer is not None:
+                writer.write(df_ready)
+            yield df_ready
+        completed = True
+    finally:
+        if writer is not None:
+            if completed:
+                writer.commit()
+            else:
+                writer.abort()
+
+
+def _read_job(job, chunksize):
+    # файлы zip из задания (job["members"]) читаются подряд как один прайс
+    for member in job.get("members") or [None]:
+        if member:
+            logger.info(f"Чтение {member} из архива {job['file_path']}")
+        yield from read_chunks(job["file_path"], job["file_type"], job["delimiter"], job["has_header"],
+                               chunksize, job["field_map"], job.get("begin_row"), member)
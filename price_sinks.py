@@ -0,0 +1,228 @@
+import os
+import re
+import sqlite3
+import zipfile
+import xml.etree.ElementTree as ET
+from loguru import logger
+import metrics
+import price_encoder
+import price_source
+from price_encoder import BatchSizer
+from price_reader import STREAM_EXCEL
+
+'''
+Способы загрузки строк прайса (sink) и выбор способа для файла.
+
+Sink принимает готовые части файла: write(df), close(flush) (или with), счётчик total.
+Атрибуты: clear_sql - запрос очистки целевой таблицы перед загрузкой файла (None - не нужен),
+target_db - строки попадают в базу, после загрузки выполняется PriceUpdate.
+
+  executemany - ExecutemanySink: пакеты executemany по одному подключению;
+  parallel    - ParallelSink (price_parallel): executemany по нескольким подключениям
+                через промежуточные таблицы;
+  bulk        - BulkSpoolSink (price_bulk): BULK INSERT файлами-частями,
+                каталог частей должен быть доступен SQL Server;
+  bcp         - BcpSink (price_bulk): те же части загружает утилита bcp с клиента;
+  null        - NullSink: строки только кодируются, база не нужна (проверка разбора);
+  sqlite      - SqliteSink: executemany в таблицу pPrice SQLite (тесты, нагрузочные прогоны).
+'''
+
+SINKS = ("executemany", "parallel", "bulk", "bcp", "null", "sqlite")
+
+# Способы без записи в базу: после них файл не отмечается загруженным
+STAND_INS = ("null", "sqlite")
+
+# Автовыбор по оценке числа строк файла: с AUTO_PARALLEL_ROWS - параллельная загрузка
+# (если задано больше одной части), с AUTO_BULK_ROWS - BULK INSERT (если задан каталог частей)
+AUTO_PARALLEL_ROWS = 200000
+AUTO_BULK_ROWS = 1000000
+
+# Сколько байт в начале текстового файла читается для оценки числа строк
+SAMPLE_BYTES = 1024 * 1024
+
+
+def estimate_rows(job):
+    """estimate_rows - оценка числа строк файла без его чтения
+
+    Текст - по числу строк в первых SAMPLE_BYTES байтах, xlsx - по размеру листа
+    из его заголовка (sheet_rows), остальные форматы Excel - по размеру файла (~100 байт на строку).
+    Для сжатых файлов и архивов - по размеру распакованных данных (см. price_source.unpacked_size),
+    начало текста распаковывается потоково, Excel из архива оценивается по размеру.
+    """
+    path = job["file_path"]
+    members = job.get("members")
+    size = price_source.unpacked_size(path, members)
+    member = members[0] if members else None
+    if job["file_type"] == 0:
+        with price_source.open_source(path, member) as f:
+            head = f.read(SAMPLE_BYTES)
+        lines = head.count(b"\n")
+        if not head or not lines:
+            return 0
+        return lines if len(head) == size else int(lines * size / len(head))
+    if not price_source.is_packed(path, member) and os.path.splitext(path)[1].lower() in STREAM_EXCEL:
+        rows = sheet_rows(path)
+        if rows:
+            return rows
+    return size // 100
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _first_sheet(zf):
+    # файл первого листа книги: workbook.xml (первый sheet) -> workbook.xml.rels (Target)
+    rid = None
+    with zf.open("xl/workbook.xml") as f:
+        for _, el in ET.iterparse(f, events=("start",)):
+            if _local(el.tag) == "sheet":
+                rid = next((v for k, v in el.attrib.items() if _local(k) == "id"), None)
+                break
+    if rid:
+        with zf.open("xl/_rels/workbook.xml.rels") as f:
+            for _, el in ET.iterparse(f, events=("start",)):
+                if _local(el.tag) == "Relationship" and el.get("Id") == rid:
+                    target = el.get("Target")
+                    return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    return "xl/worksheets/sheet1.xml"
+
+
+def sheet_rows(path):
+    """sheet_rows - число строк первого листа xlsx по <dimension ref="A1:M10000"> или None
+
+    Из архива книги читается только начало XML листа до элемента dimension (до sheetData):
+    книга не открывается, строки не читаются. Без dimension (часто у сгенерированных книг)
+    или при ref из одной ячейки размер неизвестен.
+    """
+    try:
+        with zipfile.ZipFile(path) as zf, zf.open(_first_sheet(zf)) as f:
+            for _, el in ET.iterparse(f, events=("start",)):
+                tag = _local(el.tag)
+                if tag == "dimension":
+                    match = re.search(r"[A-Z]+(\d+)$", el.get("ref", "").split(":")[-1])
+                    return int(match.group(1)) if match and ":" in el.get("ref", "") else None
+                if tag == "sheetData":
+                    return None
+    except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError) as err:
+        logger.warning(f"Не удалось прочитать размер листа {path}: {err}")
+    return None
+
+
+def choose_sink(rows, partitions=0, bulk=False):
+    """choose_sink - способ загрузки для файла из rows строк
+
+    partitions - число частей параллельной загрузки, bulk - задан каталог частей BULK INSERT.
+    """
+    if bulk and rows >= AUTO_BULK_ROWS:
+        return "bulk"
+    if partitions > 1 and rows >= AUTO_PARALLEL_ROWS:
+        return "parallel"
+    return "executemany"
+
+
+class ExecutemanySink:
+    """ExecutemanySink - вставка частей в table пакетами executemany
+
+    Размер пакета подбирает sizer (BatchSizer), если не задан batchsize.
+    """
+    target_db = True
+
+    def __init__(self, cursor, kinds=None, table="pPrice", sizer=None, batchsize=None):
+        self.cursor = cursor
+        if hasattr(cursor, "fast_executemany"):
+            cursor.fast_executemany = True
+        self.kinds = kinds
+        self.table = table
+        self.clear_sql = f"DELETE FROM {table}"
+        self.sizer = sizer or BatchSizer()
+        self.batchsize = batchsize
+        self.total = 0
+        self.seconds = 0.0
+        self._insert_sql = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(flush=exc_type is None)
+        return False
+
+    def insert_sql(self, columns):
+        key = tuple(columns)
+        if key not in self._insert_sql:
+            placeholders = ", ".join(["?"] * len(columns))
+            self._insert_sql[key] = f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({placeholders})"
+        return self._insert_sql[key]
+
+    def write_batch(self, columns, batch):
+        """write_batch - один executemany уже закодированных строк, возвращает время выполнения"""
+        with metrics.span("insert", table=self.table) as s:
+            self.cursor.executemany(self.insert_sql(columns), batch)
+            s.add(rows=len(batch))
+        self.seconds += s.duration
+        return s.duration
+
+    def write(self, df):
+        """write - вставка строк df, возвращает их число"""
+        if not len(df):
+            return 0
+        if self.batchsize:
+            batches = price_encoder.iter_batches(df, self.batchsize, self.kinds)
+        else:
+            batches = price_encoder.iter_adaptive(df, self.sizer, self.kinds)
+        columns = list(df.columns)
+        for batch in metrics.iter_spans("encode", batches, table=self.table):
+            seconds = self.write_batch(columns, batch)
+            if not self.batchsize:
+                self.sizer.observe(len(batch), seconds)
+        self.total += len(df)
+        return len(df)
+
+    def close(self, flush=True):
+        if self.total and not self.batchsize:
+            logger.info(f"Пакеты executemany в {self.table}: {self.sizer.rows} строк "
+                        f"(~{self.sizer.rows * (self.sizer.row_bytes or 0) / 2**20:.0f} МБ), "
+                        f"скорость {self.total / max(self.seconds, 1e-6):,.0f} строк/с")
+
+
+class _NullCursor:
+    def executemany(self, query, rows):
+        for _ in rows:
+            pass
+
+
+class NullSink(ExecutemanySink):
+    """NullSink - строки кодируются как для executemany и отбрасываются"""
+    target_db = False
+
+    def __init__(self, kinds=None, **kwargs):
+        super().__init__(_NullCursor(), kinds, **kwargs)
+        self.clear_sql = None
+
+
+class SqliteSink(ExecutemanySink):
+    """SqliteSink - executemany в таблицу table базы SQLite path (по умолчанию в памяти)
+
+    Таблица создаётся заново по столбцам первой части.
+    """
+    target_db = False
+
+    def __init__(self, path=":memory:", kinds=None, table="pPrice", **kwargs):
+        self.cnxn = sqlite3.connect(path, check_same_thread=False)
+        super().__init__(self.cnxn.cursor(), kinds, table, **kwargs)
+        self.clear_sql = None
+        self._created = False
+
+    def write_batch(self, columns, batch):
+        if not self._created:
+            self.cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+            self.cursor.execute(f"CREATE TABLE {self.table} ({', '.join(columns)})")
+            self._created = True
+        return super().write_batch(columns, batch)
+
+    def close(self, flush=True):
+        super().close(flush)
+        if flush:
+            self.cnxn.commit()
+        self.cnxn.close()
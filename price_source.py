@@ -0,0 +1,194 @@
+import io
+import os
+import glob
+import gzip
+import fnmatch
+import struct
+import zipfile
+from contextlib import contextmanager
+import zstandard
+from loguru import logger
+
+'''
+Файлы прайсов в архивах: .gz, .zst и .zip (в том числе с несколькими файлами).
+
+Архивы читаются потоково, без распаковки во временные файлы: разбор получает
+файловый объект, из которого распакованные данные читаются по мере чтения частей.
+Для маски профиля C:\\Prices\\48H*.txt подходят также 48H*.txt.gz, 48H*.txt.zst
+и файлы из любого .zip того же каталога, имя которых подходит под 48H*.txt.
+Если под маску подходит сам архив (например, *.zip), из него читаются все файлы.
+Из архивов берутся только файлы формата профиля (FileTypeID): текст (TEXT_EXT)
+для 0, Excel (EXCEL_EXT) для остальных - описания, pdf и прочие вложения
+не разбираются как часть прайса; файлы с именами SKIP_MEMBERS (readme, license, ...)
+не берутся, даже если расширение подходит.
+Оглавления архивов запоминаются по (размер, mtime): при опросе масок в резидентном
+режиме неизменённый zip заново не открывается.
+Excel из архива распаковывается в память: openpyxl нужен произвольный доступ к файлу.
+'''
+
+COMPRESSED = (".gz", ".zst")
+ARCHIVES = (".zip",)
+
+# Расширения файлов прайса в архиве по FileTypeID профиля
+TEXT_EXT = (".txt", ".csv", ".tsv")
+EXCEL_EXT = (".xls", ".xlsx", ".xlsm", ".xlsb")
+
+# Файлы в архиве, которые не являются прайсом (маски имён без учёта регистра)
+SKIP_MEMBERS = ("readme*", "read_me*", "read me*", "license*", "licence*", "changelog*", "описание*", "инструкция*")
+
+# Во сколько раз распакованный .zst больше сжатого, если размер не записан в кадре
+ZSTD_RATIO = 5
+
+
+def _ext(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def price_extensions(file_type):
+    """price_extensions - расширения файлов прайса для FileTypeID профиля (None - любые)"""
+    if file_type is None:
+        return None
+    return TEXT_EXT if file_type == 0 else EXCEL_EXT
+
+
+# Оглавления прочитанных архивов: путь -> ((размер, mtime), имена файлов или None)
+_listings = {}
+
+
+def _listing(path):
+    # имена файлов архива (без каталогов); оглавление zip читается без распаковки и только
+    # при изменении архива; None - архив не читается
+    try:
+        stat = os.stat(path)
+    except OSError:
+        _listings.pop(path, None)
+        return None
+    sig = (stat.st_size, stat.st_mtime_ns)
+    cached = _listings.get(path)
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    try:
+        with zipfile.ZipFile(path) as zf:
+            names = [info.filename for info in zf.infolist() if not info.is_dir()]
+    except (OSError, zipfile.BadZipFile) as err:
+        logger.warning(f"Не удалось прочитать архив {path}: {err}")
+        names = None
+    _listings[path] = (sig, names)
+    return names
+
+
+def _members(path, pattern=None, extensions=None):
+    # файлы прайса в архиве: формата extensions, имя подходит под pattern и не из SKIP_MEMBERS
+    names = _listing(path)
+    if names is None:
+        return None
+    members = []
+    for name in names:
+        base = os.path.basename(name).lower()
+        if pattern is not None and not fnmatch.fnmatch(base, pattern.lower()):
+            continue
+        if extensions is not None and _ext(name) not in extensions:
+            continue
+        if any(fnmatch.fnmatch(base, skip) for skip in SKIP_MEMBERS):
+            continue
+        members.append(name)
+    return members
+
+
+def match_files(path_mask, file_type=None):
+    """match_files - файлы маски профиля, включая сжатые и архивы: список (путь, файлы архива или None)
+
+    file_type - FileTypeID профиля: из архивов берутся только файлы этого формата (см. price_extensions).
+    """
+    extensions = price_extensions(file_type)
+    found, seen = {}, set()
+    for path in glob.glob(path_mask):
+        if _ext(path) in ARCHIVES:
+            seen.add(path)
+            members = _members(path, extensions=extensions)
+            if members:
+                found[path] = members
+            elif members is not None:
+                logger.warning(f"В архиве {path} нет файлов формата профиля")
+        elif _ext(path) in COMPRESSED and extensions and _ext(inner_name(path)) not in extensions:
+            logger.warning(f"Сжатый файл {path} не в формате профиля, пропускаем")
+        else:
+            found[path] = None
+    for ext in COMPRESSED:
+        for path in glob.glob(path_mask + ext):
+            found.setdefault(path, None)
+    pattern = os.path.basename(path_mask)
+    for path in glob.glob(os.path.join(os.path.dirname(path_mask), "*.zip")):
+        if path not in seen:
+            members = _members(path, pattern, extensions)
+            if members:
+                found[path] = members
+    return sorted(found.items())
+
+
+def inner_name(path, member=None):
+    """inner_name - имя файла внутри архива (по нему определяется формат: .txt, .xlsx, ...)"""
+    if member:
+        return member
+    if _ext(path) in COMPRESSED:
+        return os.path.splitext(path)[0]
+    return path
+
+
+def is_packed(path, member=None):
+    return bool(member) or _ext(path) in COMPRESSED
+
+
+@contextmanager
+def _open_stream(path, member=None):
+    if member:
+        with zipfile.ZipFile(path) as zf, zf.open(member) as f:
+            yield f
+    elif _ext(path) == ".gz":
+        with gzip.open(path, "rb") as f:
+            yield f
+    elif _ext(path) == ".zst":
+        with open(path, "rb") as raw, zstandard.ZstdDecompressor().stream_reader(raw) as f:
+            yield f
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+
+@contextmanager
+def open_source(path, member=None, seekable=False):
+    """open_source - двоичный файловый объект с распакованным содержимым
+
+    seekable - нужен произвольный доступ (Excel: xlsx - это zip с оглавлением в конце).
+    Распакованный файл тогда читается в память: seek назад по сжатому потоку
+    заново распаковывает его с начала.
+    """
+    with _open_stream(path, member) as f:
+        if seekable and is_packed(path, member):
+            yield io.BytesIO(f.read())
+        else:
+            yield f
+
+
+def unpacked_size(path, members=None):
+    """unpacked_size - размер распакованных данных без распаковки (оценка для .zst без размера в кадре)"""
+    if members:
+        with zipfile.ZipFile(path) as zf:
+            return sum(zf.getinfo(m).file_size for m in members)
+    size = os.path.getsize(path)
+    if _ext(path) == ".gz" and size >= 4:
+        # ISIZE в конце gzip - размер по модулю 2^32. Сжатые данные могут быть больше
+        # распакованных (маленький или несжимаемый файл), поэтому поправка на переполнение
+        # нужна, только если уже сжатый файл не меньше 4 ГБ
+        with open(path, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            isize = struct.unpack("<I", f.read(4))[0]
+        if size >= 2**32:
+            while isize < size:
+                isize += 2**32
+        return isize
+    if _ext(path) == ".zst":
+        with open(path, "rb") as f:
+            content = zstandard.frame_content_size(f.read(18))
+        return content if content > 0 else size * ZSTD_RATIO
+    return size
@@ -0,0 +1,261 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from price_encoder import to_arrow
+import metrics
+
+'''
+Проверка и удаление повторов строк прайса до отправки на сервер.
+
+Правила задаются в settings.ini: [validate] - для всех профилей,
+[validate_<MappingProfileID>] - для профиля (перекрывают общие):
+
+  enabled       = true                         - включить проверку (по умолчанию выключена)
+  normalize     = true                         - DetailNum: без пробелов и дефисов, в верхнем регистре
+  detail_pattern = ^[0-9A-Z./]+$               - допустимый DetailNum после нормализации (пусто - любой непустой)
+  min_price     = 0                            - DetailPrice должна быть больше
+  min_quantity  =                              - Quantity не меньше (пусто - не проверяется)
+  keys          = Brand, DetailNum, PriceLogo  - ключ повтора
+  keep          = min:DetailPrice              - какую строку из повторов оставить:
+                                                 min:<поле>, max:<поле> или first
+
+Повторы ищутся по хэшу ключа. Внутри части остаётся лучшая строка, между частями
+повтор разрешается по тому же правилу keep для всего файла: более выгодная строка
+может найтись в любой следующей части, поэтому части отдаются дальше (на сервер
+и в расчёт изменений price_delta) только после проверки всего файла. Пока файл
+читается, в памяти - только хэши ключей и ранги строк, сами части при нескольких
+ждут во временных файлах Arrow IPC. Из повторов ключа в файле остаётся одна строка -
+та же, что при чтении файла одной частью.
+
+Отклонённые строки с причиной (Reason) пишутся в parquet рядом с кэшем:
+[validate] rejects_path, по умолчанию cache/rejected.
+'''
+
+KEYS = "Brand, DetailNum, PriceLogo"
+KEEP = "min:DetailPrice"
+
+# Символы, удаляемые из DetailNum при нормализации
+STRIP_PATTERN = r"[\s\-]+"
+
+
+def load_rules(settings, profile_id):
+    """load_rules - правила проверки профиля из settings.ini или None, если проверка выключена
+
+    Правила - словарь простых значений: передаётся в процессы разбора вместе с заданием.
+    """
+    section = f"validate_{profile_id}"
+
+    def get(option, fallback=""):
+        return settings.get(section, option, fallback=settings.get("validate", option, fallback=fallback)).strip()
+
+    if get("enabled", "false").lower() not in ("1", "yes", "true", "on"):
+        return None
+    keep = get("keep", KEEP)
+    if keep != "first" and keep.split(":")[0] not in ("min", "max"):
+        raise ValueError(f"Некорректное правило keep = {keep} для профиля {profile_id}: ожидается min:<поле>, max:<поле> или first")
+    return {
+        "normalize": get("normalize", "true").lower() in ("1", "yes", "true", "on"),
+        "detail_pattern": get("detail_pattern"),
+        "min_price": float(get("min_price", "0")) if get("min_price", "0") else None,
+        "min_quantity": float(get("min_quantity")) if get("min_quantity") else None,
+        "keys": [k.strip() for k in get("keys", KEYS).split(",") if k.strip()],
+        "keep": keep,
+    }
+
+
+def normalize_detail(s):
+    """normalize_detail - номер детали без пробелов и дефисов в верхнем регистре"""
+    return s.str.replace(STRIP_PATTERN, "", regex=True).str.upper()
+
+
+class PriceValidator:
+    """PriceValidator - проверка частей одного файла по правилам rules (см. load_rules)
+
+    rejects_path - parquet для отклонённых строк (None - не сохранять).
+    """
+
+    def __init__(self, rules, rejects_path=None, file=""):
+        self.rules = rules
+        self.rejects_path = rejects_path
+        self.file = file
+        self.accepted = 0
+        self.superseded = 0
+        self.rejected = {}
+        # хэши ключей и ранги (меньше - лучше) принятых строк по частям; None - в части нет ключа
+        self._keys = []
+        self._ranks = []
+        self._writer = None
+        self._schema = None
+
+    def _rank(self, df):
+        keep = self.rules["keep"]
+        field = keep.partition(":")[2]
+        if keep == "first" or field not in df.columns:
+            # первая строка лучше всех следующих
+            return np.zeros(len(df))
+        values = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        if keep.startswith("max"):
+            values = -values
+        return np.nan_to_num(values, nan=np.inf)
+
+    def _dedup(self, df):
+        # лучшая строка каждого ключа внутри части; хэши и ранги принятых строк запоминаются
+        # для разрешения повторов между частями (см. _winners)
+        keys = [k for k in self.rules["keys"] if k in df.columns]
+        if not keys or not len(df):
+            self._keys.append(None)
+            self._ranks.append(None)
+            return np.ones(len(df), dtype=bool)
+        h = pd.util.hash_pandas_object(df[keys], index=False).to_numpy()
+        rank = self._rank(df)
+
+        # после сортировки по ключу и рангу первая строка ключа - лучшая
+        order = np.lexsort((np.arange(len(df)), rank, h))
+        sorted_h = h[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_h[1:] != sorted_h[:-1]
+        mask = np.zeros(len(df), dtype=bool)
+        mask[order[first]] = True
+        self._keys.append(h[mask])
+        self._ranks.append(rank[mask])
+        return mask
+
+    def _winners(self):
+        # строки частей, лучшие для своего ключа во всём файле: маска на каждую часть
+        masks = [None] * len(self._keys)
+        parts = [i for i, h in enumerate(self._keys) if h is not None]
+        if len(parts) < 2:
+            return masks
+        h = np.concatenate([self._keys[i] for i in parts])
+        rank = np.concatenate([self._ranks[i] for i in parts])
+        # при равном ранге лучше строка из более ранней части, как внутри части
+        order = np.lexsort((np.arange(len(h)), rank, h))
+        sorted_h = h[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_h[1:] != sorted_h[:-1]
+        best = np.zeros(len(h), dtype=bool)
+        best[order[first]] = True
+        offset = 0
+        for i in parts:
+            masks[i] = best[offset:offset + len(self._keys[i])]
+            offset += len(self._keys[i])
+        return masks
+
+    def validate(self, df):
+        """validate - строки части, прошедшие проверку; отклонённые уходят в rejects_path"""
+        with metrics.span("validate", file=self.file) as s:
+            rules = self.rules
+            reason = pd.Series(None, index=df.index, dtype=object)
+
+            if "DetailNum" in df.columns:
+                detail = df["DetailNum"]
+                if not pd.api.types.is_string_dtype(detail.dtype):
+                    detail = detail.astype(str)
+                if rules["normalize"]:
+                    detail = normalize_detail(detail)
+                    df = df.assign(DetailNum=detail)
+                bad = detail.eq("")
+                if rules["detail_pattern"]:
+                    bad |= ~detail.str.fullmatch(rules["detail_pattern"])
+                reason[bad.to_numpy()] = "detailnum"
+            if rules["min_price"] is not None and "DetailPrice" in df.columns:
+                price = pd.to_numeric(df["DetailPrice"], errors="coerce")
+                bad = ~(price > rules["min_price"]) & reason.isna()
+                reason[bad.to_numpy()] = "price"
+            if rules["min_quantity"] is not None and "Quantity" in df.columns:
+                quantity = pd.to_numeric(df["Quantity"], errors="coerce")
+                bad = ~(quantity >= rules["min_quantity"]) & reason.isna()
+                reason[bad.to_numpy()] = "quantity"
+
+            valid = reason.isna().to_numpy()
+            keep = np.zeros(len(df), dtype=bool)
+            keep[valid] = self._dedup(df[valid])
+            reason[valid & ~keep] = "duplicate"
+
+            if not keep.all():
+                self._reject(df[~keep], reason[~keep])
+            df = df[keep]
+            self.accepted += len(df)
+            s.add(rows=len(df))
+        return df
+
+    def _reject(self, df, reason):
+        for name, count in reason.value_counts().items():
+            self.rejected[name] = self.rejected.get(name, 0) + int(count)
+        if not self.rejects_path:
+            return
+        # все поля строками: схема одна на файл, даже если типы столбцов в частях различаются
+        table = pa.Table.from_pandas(df.astype("string").assign(Reason=reason.to_numpy()), preserve_index=False)
+        if self._writer is None:
+            self._schema = pa.schema([pa.field(f.name, pa.string()) for f in table.schema])
+            self._writer = pq.ParquetWriter(self.rejects_path + ".tmp", self._schema, compression="zstd")
+        self._writer.write_table(table.select(self._schema.names).cast(self._schema))
+
+    def chunks(self, chunks):
+        """chunks - проверка частей файла, генератор прошедших строк
+
+        Части отдаются после проверки всего файла (см. описание модуля). Единственная
+        часть остаётся в памяти, при нескольких они пишутся во временный каталог.
+        """
+        completed = False
+        spool_dir = None
+        parts = []
+        try:
+            for df in chunks:
+                df = self.validate(df)
+                if len(parts) == 1 and spool_dir is None:
+                    spool_dir = tempfile.mkdtemp(prefix="validate_")
+                    parts[0] = self._spool(spool_dir, 0, parts[0])
+                parts.append(self._spool(spool_dir, len(parts), df) if spool_dir else df)
+            for part, best in zip(parts, self._winners()):
+                df = self._read(part) if spool_dir else part
+                if best is not None and not best.all():
+                    # повтор ключа с более выгодной строкой в другой части файла
+                    self.superseded += int((~best).sum())
+                    self.accepted -= int((~best).sum())
+                    self._reject(df[~best], pd.Series("duplicate", index=df.index[~best], dtype=object))
+                    df = df[best]
+                if len(df):
+                    yield df
+            completed = True
+        finally:
+            if spool_dir is not None:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+            self.close(completed)
+
+    @staticmethod
+    def _spool(spool_dir, i, df):
+        path = os.path.join(spool_dir, f"{i}.arrow")
+        table = to_arrow(df)
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return path
+
+    @staticmethod
+    def _read(path):
+        with pa.memory_map(path) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        os.remove(path)
+        return df
+
+    def close(self, completed=True):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if completed:
+                os.replace(self.rejects_path + ".tmp", self.rejects_path)
+            else:
+                os.remove(self.rejects_path + ".tmp")
+        elif completed and self.rejects_path and os.path.exists(self.rejects_path):
+            # отклонённых строк нет: файл прошлой загрузки больше не актуален
+            os.remove(self.rejects_path)
+        if completed:
+            rejected = ", ".join(f"{name} {count}" for name, count in sorted(self.rejected.items())) or "нет"
+            logger.info(f"Проверка строк файла {self.file}: принято {self.accepted}, отклонено: {rejected}, "
+                        f"из них повторов из разных частей файла: {self.superseded}"
+                        + (f", отклонённые строки: {self.rejects_path}" if self.rejected and self.rejects_path else ""))
@@ -0,0 +1,242 @@
+import os
+import glob
+import time
+import signal
+import threading
+from loguru import logger
+from _utils import get_settings, metrics_dir
+import metrics
+
+'''
+Резидентный режим загрузки: вместо запуска по расписанию процесс работает постоянно.
+
+Импорты, пул подключений и метаданные профилей остаются загруженными между
+загрузками. Маски FilePath всех профилей опрашиваются каждые interval секунд.
+Файл считается готовым, когда его размер и время изменения не менялись settle
+секунд и он открывается на чтение (копирование завершено). Готовый файл
+передаётся загрузчику один раз для каждой версии (размер, mtime); файлы, уже
+загруженные в том же виде, отсекает манифест (см. FileManifest). Если загрузка
+не удалась (база недоступна, блокировка), файл передаётся снова через retry секунд.
+
+Профили сверяются с базой (запрос версии, см. ProfileMetadata) не чаще
+одного раза в profiles_seconds секунд. Каждый цикл, в котором были файлы,
+пишет метрики в отдельный файл запуска.
+
+Там же по расписанию выполняются загрузка курсов валют ([watch] currency_minutes)
+и справочника брендов при появлении файла в [LoadPath] MakesFile ([watch] brands).
+'''
+
+# Период опроса масок, секунд
+INTERVAL = 2
+
+# Сколько секунд размер и время изменения файла не должны меняться
+SETTLE = 5
+
+# Период сверки профилей с базой, секунд
+PROFILES_SECONDS = 60
+
+# Через сколько секунд повторить загрузку файла после ошибки
+RETRY = 60
+
+
+def can_open(path):
+    """can_open - файл открывается на чтение (в Windows копируемый файл ещё заблокирован)"""
+    try:
+        with open(path, "rb"):
+            return True
+    except OSError:
+        return False
+
+
+class StableFiles:
+    """StableFiles - отбор файлов, запись которых завершена
+
+    ready(key, path) возвращает True один раз для каждой версии файла (размер, mtime),
+    после того как она не менялась settle секунд (снова - после release, если загрузка
+    не удалась). key различает файл в разных профилях.
+    """
+
+    def __init__(self, settle=SETTLE):
+        self.settle = settle
+        # key -> [(size, mtime), с какого момента не меняется, уже передан, номер опроса]
+        self._seen = {}
+        self._poll = 0
+
+    def ready(self, key, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._seen.pop(key, None)
+            return False
+        sig = (stat.st_size, stat.st_mtime_ns)
+        now = time.monotonic()
+        entry = self._seen.get(key)
+        if entry is None or entry[0] != sig:
+            self._seen[key] = [sig, now, False, self._poll]
+            return False
+        entry[3] = self._poll
+        if entry[2] or now - entry[1] < self.settle or not can_open(path):
+            return False
+        entry[2] = True
+        return True
+
+    def release(self, key, delay=0.0):
+        """release - файл не загружен: вернуть его версию в отбор через delay секунд (и settle)"""
+        entry = self._seen.get(key)
+        if entry is not None:
+            entry[1] = time.monotonic() + delay
+            entry[2] = False
+
+    def sweep(self):
+        """sweep - забыть файлы, которые не встречались в последнем опросе (удалены, перенесены в архив)"""
+        self._seen = {key: entry for key, entry in self._seen.items() if entry[3] == self._poll}
+        self._poll += 1
+
+
+class Task:
+    """Task - действие по расписанию в резидентном режиме: func раз в seconds секунд"""
+
+    def __init__(self, name, seconds, func):
+        self.name = name
+        self.seconds = seconds
+        self.func = func
+        self.due = 0.0
+
+    def run_due(self):
+        if time.monotonic() < self.due:
+            return
+        self.due = time.monotonic() + self.seconds
+        try:
+            self.func()
+        except Exception as ex:
+            logger.error(f"Ошибка задачи {self.name}: {ex}")
+
+
+class PriceWatcher:
+    """PriceWatcher - постоянный опрос масок профилей и загрузка готовых файлов
+
+    loader - PriceLoader (load_prices_dynamic), один на всё время работы.
+    workers, processes - как в PriceLoader.process_all_profiles.
+    """
+
+    def __init__(self, loader, interval=INTERVAL, settle=SETTLE, profiles_seconds=PROFILES_SECONDS,
+                 workers=0, processes=False, tasks=(), retry=RETRY):
+        self.loader = loader
+        self.retry = retry
+        self.interval = interval
+        self.profiles_seconds = profiles_seconds
+        self.workers = workers
+        self.processes = processes
+        self.tasks = list(tasks)
+        self.files = StableFiles(settle)
+        self.stop_event = threading.Event()
+        self._profiles = None
+        self._profiles_due = 0.0
+
+    def profiles(self):
+        """profiles - профили из памяти, сверка с базой не чаще profiles_seconds"""
+        if self._profiles is None or time.monotonic() >= self._profiles_due:
+            self._profiles = self.loader.get_profiles()
+            self._profiles_due = time.monotonic() + self.profiles_seconds
+        return self._profiles
+
+    def poll(self):
+        """poll - один опрос: загрузка готовых файлов, возвращает их число"""
+        jobs = list(self.loader.get_file_jobs(self.profiles(), accept=self.files.ready))
+        self.files.sweep()
+        if not jobs:
+            return 0
+        logger.info(f"Готовы к загрузке файлов: {len(jobs)}")
+        metrics.start_run("load_prices_watch", metrics_dir())
+        try:
+            self.loader.process_all_profiles(self.workers, self.processes, jobs=jobs)
+        finally:
+            metrics.end_run()
+            # файл считается переданным только после успешной загрузки (PriceLoader.file_done)
+            failed = [job for job in jobs if not job.get("loaded")]
+            for job in failed:
+                self.files.release((job["profile_id"], job["file_path"]), self.retry)
+            if failed:
+                logger.warning(f"Не загружено файлов: {len(failed)}, повтор через {self.retry} с")
+        return len(jobs)
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def run(self):
+        """run - опрос до остановки (Ctrl+C, SIGTERM или stop())"""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                signal.signal(sig, self.stop)
+            except ValueError:
+                # обработчики сигналов ставятся только из основного потока
+                pass
+        logger.info(f"Резидентный режим: опрос каждые {self.interval} с, файл готов через {self.files.settle} с без изменений")
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as ex:
+                # например, база недоступна: пробуем снова в следующем опросе
+                logger.error(f"Ошибка опроса файлов: {ex}")
+                self._profiles_due = 0.0
+            for task in self.tasks:
+                task.run_due()
+            self.stop_event.wait(self.interval)
+        logger.info("Резидентный режим остановлен")
+
+
+def currency_task(minutes):
+    """currency_task - загрузка курсов валют раз в minutes минут (подключение CurrencyLoader сохраняется)"""
+    state = {}
+
+    def run():
+        from load_currency import CurrencyLoader
+        if "loader" not in state:
+            state["loader"] = CurrencyLoader()
+        try:
+            state["loader"].load_currency()
+        except Exception:
+            # подключение будет создано заново в следующий раз
+            state.pop("loader", None)
+            raise
+
+    return Task("load_currency", minutes * 60, run)
+
+
+def brands_task(interval, settle=SETTLE):
+    """brands_task - загрузка справочника брендов при появлении готового файла в [LoadPath] MakesFile"""
+    files = StableFiles(settle)
+
+    def run():
+        from load_brands import BrandLoader, config
+        directory = config["LoadPath"]["MakesFile"]
+        ready = [path for path in glob.glob(os.path.join(directory, "*.txt")) if files.ready(path, path)]
+        files.sweep()
+        if not ready:
+            return
+        # новое подключение на каждую загрузку: временная таблица #makes живёт до конца сессии
+        try:
+            loader = BrandLoader()
+        except Exception:
+            # база недоступна: файлы будут загружены в следующий раз
+            for path in ready:
+                files.release(path, RETRY)
+            raise
+        try:
+            loader.process_load_makes()
+        finally:
+            loader.sql.close()
+
+    return Task("load_brands", interval, run)
+
+
+def settings_tasks(interval):
+    """settings_tasks - задачи по расписанию из [watch] settings.ini"""
+    settings = get_settings()
+    tasks = []
+    minutes = settings.getint("watch", "currency_minutes", fallback=0)
+    if minutes > 0:
+        tasks.append(currency_task(minutes))
+    if settings.getboolean("watch", "brands", fallback=False):
+        tasks.append(brands_task(interval))
+    return tasks
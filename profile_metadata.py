@@ -0,0 +1,164 @@
+import os
+import json
+from loguru import logger
+from connect import retry
+
+'''
+Метаданные профилей маппинга (tMappingProfiles, tMappingFields, tFields, tDelimiter).
+
+Все активные профили вместе с полями и разделителями читаются одним запросом
+и сохраняются в локальный кэш. При следующем обращении выполняется только
+короткий запрос версии (контрольные суммы и число строк таблиц метаданных):
+если версия не изменилась, профили берутся из кэша.
+'''
+
+# Тип маппинга для загрузки прайсов
+PRICE_MAPPING_TYPE = 15
+
+VERSION_QUERY = """
+SELECT
+       (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(m.MappingProfileID, m.FileTypeID, m.FilePath, m.DelimiterID,
+                                            m.Flag, m.BeginRow, m.FileNames, m.isActive))
+          FROM tMappingProfiles m WITH (NOLOCK)
+         WHERE m.MappingTypeID = ?) AS Profiles,
+       (SELECT COUNT_BIG(*)
+          FROM tMappingProfiles m WITH (NOLOCK)
+         WHERE m.MappingTypeID = ?) AS ProfilesCount,
+       (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(t.MappingProfileID, t.MappingGroup, t.FieldID,
+                                            t.DataType, t.DataValue, t.Flag))
+          FROM tMappingFields t WITH (NOLOCK)
+          JOIN tMappingProfiles m WITH (NOLOCK)
+            ON m.MappingProfileID = t.MappingProfileID
+         WHERE m.MappingTypeID = ?) AS Fields,
+       (SELECT COUNT_BIG(*)
+          FROM tMappingFields t WITH (NOLOCK)
+          JOIN tMappingProfiles m WITH (NOLOCK)
+            ON m.MappingProfileID = t.MappingProfileID
+         WHERE m.MappingTypeID = ?) AS FieldsCount,
+       (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(f.FieldID, f.Brief, f.Name, f.DataType))
+          FROM tFields f WITH (NOLOCK)) AS FieldTypes,
+       (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(d.DelimiterID, d.Brief, d.Name))
+          FROM tDelimiter d WITH (NOLOCK)) AS Delimiters
+"""
+
+PROFILES_QUERY = """
+SELECT
+      m.MappingProfileID,
+      m.FileTypeID,
+      m.FilePath,
+      m.DelimiterID,
+      d.Brief AS DelimiterBrief,
+      d.Name AS DelimiterName,
+      m.Flag AS Flag,
+      m.BeginRow,
+      m.FileNames,
+      t.MappingProfileID AS FieldProfileID,
+      t.MappingGroup,
+      f.FieldID,
+      f.Brief AS FieldBrief,
+      f.Name AS FieldName,
+      f.DataType AS FieldDataType,
+      t.DataType,
+      t.DataValue,
+      t.Flag AS FieldFlag
+ FROM tMappingProfiles m WITH (NOLOCK)
+ LEFT JOIN tDelimiter d WITH (NOLOCK)
+        ON d.DelimiterID = m.DelimiterID
+ LEFT JOIN tMappingFields t WITH (NOLOCK)
+        ON t.MappingProfileID = m.MappingProfileID
+ LEFT JOIN tFields f WITH (NOLOCK)
+        ON f.FieldID = t.FieldID
+WHERE m.MappingTypeID = ?
+  AND m.isActive = 1
+ORDER BY m.MappingProfileID
+"""
+
+PROFILE_COLUMNS = ["MappingProfileID", "FileTypeID", "FilePath", "DelimiterID", "DelimiterBrief",
+                   "DelimiterName", "Flag", "BeginRow", "FileNames"]
+
+
+class ProfileMetadata:
+    """ProfileMetadata - профили маппинга с полями, кэшируемые локально до изменения версии"""
+
+    def __init__(self, db, cache_path, mapping_type=PRICE_MAPPING_TYPE):
+        # db - Sql или SqlPool (подключение берётся через connection_scope)
+        self.db = db
+        self.cache_path = cache_path
+        self.mapping_type = mapping_type
+        self.version = None
+        self._profiles = []
+        self._fields = {}
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, encoding="utf-8") as f:
+                    cached = json.load(f)
+                self._set(cached["version"], cached["profiles"])
+            except (OSError, ValueError, KeyError) as err:
+                logger.warning(f"Не удалось прочитать кэш профилей {cache_path}: {err}")
+
+    def _set(self, version, profiles):
+        self.version = version
+        self._profiles = [{k: v for k, v in p.items() if k != "Fields"} for p in profiles]
+        self._fields = {p["MappingProfileID"]: p["Fields"] for p in profiles}
+
+    def _fetch_rows(self, query, *params):
+        with self.db.connection_scope() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(query, *params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _query(self, query, *params):
+        # запросы только читают, поэтому повторяются при временных ошибках
+        return retry(self._fetch_rows, query, *params)
+
+    def current_version(self):
+        """current_version - версия метаданных на сервере (один короткий запрос)"""
+        row = self._query(VERSION_QUERY, *([self.mapping_type] * 4))[0]
+        return [row[k] for k in sorted(row)]
+
+    def fetch(self):
+        """fetch - все активные профили с полями одним запросом"""
+        profiles = {}
+        for row in self._query(PROFILES_QUERY, self.mapping_type):
+            profile_id = row["MappingProfileID"]
+            if profile_id not in profiles:
+                profiles[profile_id] = dict({k: row[k] for k in PROFILE_COLUMNS}, Fields=[])
+            if row["FieldProfileID"] is not None:
+                profiles[profile_id]["Fields"].append({
+                    "MappingProfileID": profile_id,
+                    "MappingGroup": row["MappingGroup"],
+                    "FieldID": row["FieldID"],
+                    "FieldBrief": row["FieldBrief"],
+                    "FieldName": row["FieldName"],
+                    "FieldDataType": row["FieldDataType"],
+                    "DataType": row["DataType"],
+                    "DataValue": row["DataValue"],
+                    "Flag": row["FieldFlag"],
+                })
+        return list(profiles.values())
+
+    def refresh(self):
+        """refresh - сверить версию и перечитать профили, если они изменились"""
+        version = json.loads(json.dumps(self.current_version(), default=str))
+        if version == self.version:
+            logger.info("Профили маппинга не изменились, используется кэш")
+            return False
+
+        profiles = self.fetch()
+        self._set(version, profiles)
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "profiles": profiles}, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self.cache_path)
+        logger.info(f"Профили маппинга загружены из базы: {len(profiles)}")
+        return True
+
+    def profiles(self):
+        """profiles - активные профили (с проверкой версии)"""
+        self.refresh()
+        return list(self._profiles)
+
+    def fields(self, profile_id):
+        """fields - поля маппинга профиля из уже загруженных метаданных"""
+        return self._fields.get(profile_id, [])
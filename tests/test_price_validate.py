@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from price_validate import PriceValidator
+from price_delta import PriceSnapshot, row_hash
+
+RULES = {
+    "normalize": True,
+    "detail_pattern": "",
+    "min_price": 0.0,
+    "min_quantity": None,
+    "keys": ["Brand", "DetailNum", "PriceLogo"],
+    "keep": "min:DetailPrice",
+}
+
+
+def _chunks():
+    # повтор AAA/1234: в первой части цена хуже, чем во второй
+    yield pd.DataFrame({"Brand": ["AAA", "BBB"], "DetailNum": ["1234", "55"],
+                        "PriceLogo": ["P1", "P1"], "DetailPrice": [10.5, 3.0]})
+    yield pd.DataFrame({"Brand": ["CCC", "AAA"], "DetailNum": ["77", "12-34"],
+                        "PriceLogo": ["P1", "P1"], "DetailPrice": [1.0, 9.5]})
+
+
+def _rows(parts):
+    df = pd.concat(parts, ignore_index=True)
+    return sorted(zip(df["Brand"], df["DetailNum"], df["DetailPrice"]))
+
+
+def test_full_load_keeps_best_row_across_chunks(tmp_path):
+    rejects = str(tmp_path / "rejected.parquet")
+    validator = PriceValidator(RULES, rejects, "p.txt")
+    parts = list(validator.chunks(_chunks()))
+
+    assert _rows(parts) == [("AAA", "1234", 9.5), ("BBB", "55", 3.0), ("CCC", "77", 1.0)]
+    assert validator.accepted == 3
+    assert validator.superseded == 1
+    assert validator.rejected == {"duplicate": 1}
+    rejected = pd.read_parquet(rejects)
+    assert rejected["DetailPrice"].tolist() == ["10.5"]
+
+
+def test_delta_load_diffs_best_row_across_chunks(tmp_path):
+    path = str(tmp_path / "snapshot.parquet")
+    # прошлая загрузка: AAA/1234 по 10.0, BBB/55 без изменений
+    old = pd.DataFrame({"Brand": ["AAA", "BBB"], "DetailNum": ["1234", "55"],
+                        "PriceLogo": ["P1", "P1"], "DetailPrice": [10.0, 3.0]})
+    snapshot = PriceSnapshot(path)
+    for df in PriceValidator(RULES).chunks(iter([old])):
+        snapshot.diff(df)
+    snapshot.save()
+
+    snapshot = PriceSnapshot(path)
+    delta = pd.concat([snapshot.diff(df) for df in PriceValidator(RULES).chunks(_chunks())], ignore_index=True)
+    assert sorted(zip(delta["Brand"], delta["DetailPrice"], delta["Op"])) == [("AAA", 9.5, "U"), ("CCC", 1.0, "I")]
+    assert snapshot.deleted().empty
+    snapshot.save()
+
+    # в снимке - хэш лучшей строки: повторная загрузка того же файла изменений не даёт
+    saved = pd.read_parquet(path).set_index("Brand")
+    best = delta[delta["Brand"] == "AAA"].drop(columns="Op")
+    assert saved.loc["AAA", "RowHash"] == np.uint64(row_hash(best)[0])
+    snapshot = PriceSnapshot(path)
+    assert sum(len(snapshot.diff(df)) for df in PriceValidator(RULES).chunks(_chunks())) == 0